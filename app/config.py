@@ -0,0 +1,166 @@
+import os
+from dotenv import load_dotenv
+
+# Подгружаем .env сразу, чтобы настройки были доступны при импорте модулей
+load_dotenv()
+
+# --- СКЛЕЙКА СООБЩЕНИЙ (DEBOUNCE) ---
+# Telegram режет длинные вставки на несколько сообщений, а люди часто пишут мысль в 2-3 сообщения.
+# Если пауза между сообщениями меньше окна, они склеиваются в один запрос к нейросети.
+# 0 — склейка выключена, каждое сообщение обрабатывается сразу.
+TEXT_DEBOUNCE_SECONDS = float(os.getenv("TEXT_DEBOUNCE_SECONDS", "0"))
+
+# --- БЮДЖЕТЫ ТОКЕНОВ ---
+# Сколько токенов запроса принимаем от пользователя (оценка делается локально, без сети)
+MAX_PROMPT_TOKENS_FREE = int(os.getenv("MAX_PROMPT_TOKENS_FREE", "2000"))
+MAX_PROMPT_TOKENS_PREMIUM = int(os.getenv("MAX_PROMPT_TOKENS_PREMIUM", "8000"))
+# Что делать со слишком длинным запросом: "truncate" — обрезать, "reject" — отказать
+PROMPT_OVERFLOW_MODE = os.getenv("PROMPT_OVERFLOW_MODE", "truncate")
+
+# Потолок длины ответа (max_tokens) для нейросети
+MAX_OUTPUT_TOKENS_FREE = int(os.getenv("MAX_OUTPUT_TOKENS_FREE", "800"))
+MAX_OUTPUT_TOKENS_PREMIUM = int(os.getenv("MAX_OUTPUT_TOKENS_PREMIUM", "2000"))
+
+# --- ОЧЕРЕДЬ ГЕНЕРАЦИИ КАРТИНОК ---
+# Сколько картинок рисуется одновременно
+IMG_WORKERS = int(os.getenv("IMG_WORKERS", "2"))
+# Максимум задач в очереди (ожидающих), сверх этого /img отвечает "попробуйте позже"
+IMG_QUEUE_MAX_SIZE = int(os.getenv("IMG_QUEUE_MAX_SIZE", "50"))
+# Сколько задач (в очереди + в работе) может быть у одного пользователя
+IMG_MAX_JOBS_PER_USER_FREE = int(os.getenv("IMG_MAX_JOBS_PER_USER_FREE", "1"))
+IMG_MAX_JOBS_PER_USER_PREMIUM = int(os.getenv("IMG_MAX_JOBS_PER_USER_PREMIUM", "3"))
+# Повторы при ошибке генерации: число попыток и базовая пауза (удваивается с каждой попыткой)
+IMG_MAX_ATTEMPTS = int(os.getenv("IMG_MAX_ATTEMPTS", "3"))
+IMG_RETRY_DELAY = float(os.getenv("IMG_RETRY_DELAY", "2"))
+
+# --- ПАРАМЕТРЫ ГЕНЕРАЦИИ КАРТИНОК ---
+# Прогрессивный режим: параллельно с полной картинкой рисуем маленькое превью и показываем его сразу
+IMG_PROGRESSIVE = os.getenv("IMG_PROGRESSIVE", "1") == "1"
+# Полная картинка: сторона в пикселях, модель Pollinations и число шагов (0 — по умолчанию сервиса)
+IMG_SIZE_FREE = int(os.getenv("IMG_SIZE_FREE", "1024"))
+IMG_SIZE_PREMIUM = int(os.getenv("IMG_SIZE_PREMIUM", "1024"))
+IMG_MODEL_FREE = os.getenv("IMG_MODEL_FREE", "flux")
+IMG_MODEL_PREMIUM = os.getenv("IMG_MODEL_PREMIUM", "flux")
+IMG_STEPS_FREE = int(os.getenv("IMG_STEPS_FREE", "0"))
+IMG_STEPS_PREMIUM = int(os.getenv("IMG_STEPS_PREMIUM", "0"))
+# Превью: то же самое, но маленькое и быстрое
+IMG_PREVIEW_SIZE_FREE = int(os.getenv("IMG_PREVIEW_SIZE_FREE", "256"))
+IMG_PREVIEW_SIZE_PREMIUM = int(os.getenv("IMG_PREVIEW_SIZE_PREMIUM", "384"))
+IMG_PREVIEW_MODEL_FREE = os.getenv("IMG_PREVIEW_MODEL_FREE", "flux")
+IMG_PREVIEW_MODEL_PREMIUM = os.getenv("IMG_PREVIEW_MODEL_PREMIUM", "flux")
+IMG_PREVIEW_STEPS_FREE = int(os.getenv("IMG_PREVIEW_STEPS_FREE", "0"))
+IMG_PREVIEW_STEPS_PREMIUM = int(os.getenv("IMG_PREVIEW_STEPS_PREMIUM", "0"))
+
+# --- ДЕДЛАЙНЫ И ПОВТОРЫ ВНЕШНИХ ВЫЗОВОВ ---
+# Сколько секунд всего может занять обработка одного апдейта (все вызовы нейросети, оплаты, Telegram)
+UPDATE_DEADLINE_SECONDS = float(os.getenv("UPDATE_DEADLINE_SECONDS", "60"))
+# Бюджет на одну задачу генерации картинки (включая повторы)
+IMG_JOB_DEADLINE_SECONDS = float(os.getenv("IMG_JOB_DEADLINE_SECONDS", "120"))
+# Повторы идемпотентных вызовов: число попыток и базовая пауза (растет экспоненциально, со случайным разбросом)
+EXTERNAL_MAX_ATTEMPTS = int(os.getenv("EXTERNAL_MAX_ATTEMPTS", "3"))
+EXTERNAL_RETRY_BASE_DELAY = float(os.getenv("EXTERNAL_RETRY_BASE_DELAY", "0.5"))
+# Потолок одной попытки, секунд: зависший вызов обрывается раньше, и на повтор остается бюджет
+EXTERNAL_ATTEMPT_TIMEOUT = float(os.getenv("EXTERNAL_ATTEMPT_TIMEOUT", "25"))
+# То же для генерации картинки (она заметно дольше текста)
+IMG_ATTEMPT_TIMEOUT = float(os.getenv("IMG_ATTEMPT_TIMEOUT", "45"))
+
+# --- ЗАЩИТА ОТ ПЕРЕГРУЗКИ (ADMISSION CONTROL) ---
+# Сколько запросов к нейросети обрабатываются одновременно, остальные ждут в очереди (премиум — первыми)
+ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "40"))
+# Сколько из этих слотов только для премиума: free не может занять их, даже когда премиум-запросов нет
+PREMIUM_RESERVED_SLOTS = int(os.getenv("PREMIUM_RESERVED_SLOTS", "8"))
+# Стадия 1 (деградация free): самый старый запрос ждет дольше N секунд или в очереди больше N запросов
+SHED_DEGRADE_WAIT = float(os.getenv("SHED_DEGRADE_WAIT", "3"))
+SHED_DEGRADE_QUEUE = int(os.getenv("SHED_DEGRADE_QUEUE", "20"))
+# Стадия 2 (отказ free): те же метрики, пороги выше
+SHED_REJECT_WAIT = float(os.getenv("SHED_REJECT_WAIT", "15"))
+SHED_REJECT_QUEUE = int(os.getenv("SHED_REJECT_QUEUE", "100"))
+# Более дешевая/быстрая модель для free-запросов на стадии деградации (пусто — модель не меняем)
+DEGRADED_TEXT_MODEL = os.getenv("DEGRADED_TEXT_MODEL", "")
+
+# --- ПРОФИЛИРОВАНИЕ (АДМИНКА) ---
+# Длительность профилирования по кнопке и максимум для /profile N
+PROFILE_DEFAULT_SECONDS = int(os.getenv("PROFILE_DEFAULT_SECONDS", "30"))
+PROFILE_MAX_SECONDS = int(os.getenv("PROFILE_MAX_SECONDS", "300"))
+# Как часто снимаем стек главного потока, секунд
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+# Callback event loop'а дольше этого порога считается медленным, секунд
+PROFILE_SLOW_CALLBACK = float(os.getenv("PROFILE_SLOW_CALLBACK", "0.1"))
+# Сколько строк в каждом топе отчета
+PROFILE_TOP_N = int(os.getenv("PROFILE_TOP_N", "10"))
+
+# --- ИСХОДЯЩИЕ ЗАПРОСЫ В TELEGRAM ---
+# Общий лимит отправок в секунду на всего бота (Telegram: ~30/с)
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "30"))
+# Лимит на один личный чат: в среднем N сообщений в секунду, пачкой не больше SEND_CHAT_BURST
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", "1"))
+SEND_CHAT_BURST = int(os.getenv("SEND_CHAT_BURST", "3"))
+# Лимит на группу/канал (Telegram: ~20 сообщений в минуту)
+SEND_GROUP_RATE = float(os.getenv("SEND_GROUP_RATE", str(20 / 60)))
+# Сколько раз повторяем запрос после 429 (RetryAfter)
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "3"))
+
+# --- НЕСКОЛЬКО ПРОЦЕССОВ ---
+# Число процессов-обработчиков апдейтов (1 — как раньше, все в одном процессе)
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "1"))
+# Публичный URL для вебхука Telegram (пусто — фронт сам забирает апдейты через getUpdates)
+TG_WEBHOOK_URL = os.getenv("TG_WEBHOOK_URL", "")
+TG_WEBHOOK_SECRET = os.getenv("TG_WEBHOOK_SECRET", "")
+# Как часто фронт проверяет, живы ли воркеры (упавший перезапускается на той же очереди), сек
+WORKER_WATCHDOG_INTERVAL = float(os.getenv("WORKER_WATCHDOG_INTERVAL", "5"))
+
+# Лимиты выше заданы на весь бот, каждому процессу достается своя доля.
+# Отправляет и фронт (уведомления об оплате), поэтому общий лимит делим на BOT_WORKERS + 1
+SEND_GLOBAL_RATE_PER_PROCESS = SEND_GLOBAL_RATE / (BOT_WORKERS + 1) if BOT_WORKERS > 1 else SEND_GLOBAL_RATE
+ADMISSION_MAX_CONCURRENCY_PER_PROCESS = max(1, ADMISSION_MAX_CONCURRENCY // BOT_WORKERS)
+# Резерв округляем вверх, но хотя бы один слот оставляем free
+PREMIUM_RESERVED_SLOTS_PER_PROCESS = max(0, min(
+    ADMISSION_MAX_CONCURRENCY_PER_PROCESS - 1, -(-PREMIUM_RESERVED_SLOTS // BOT_WORKERS)
+))
+IMG_WORKERS_PER_PROCESS = max(1, IMG_WORKERS // BOT_WORKERS)
+IMG_QUEUE_MAX_SIZE_PER_PROCESS = max(1, IMG_QUEUE_MAX_SIZE // BOT_WORKERS)
+
+# --- БАЗА ДАННЫХ (SQLITE) ---
+# Соединений для чтения (запись всегда идет через одно соединение писателя)
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "5"))
+# NORMAL в режиме WAL не портит базу при сбое, но может потерять последние коммиты при отключении питания
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL")
+# Кэш страниц и отображение файла базы в память, мегабайт
+DB_CACHE_MB = int(os.getenv("DB_CACHE_MB", "64"))
+DB_MMAP_MB = int(os.getenv("DB_MMAP_MB", "256"))
+# Сколько ждать блокировку базы, занятую другим процессом, миллисекунд
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+# Такт группового коммита, секунд: записи, пришедшие за это время, уходят одной транзакцией.
+# 0 — не ждем: в пачку попадает все, что накопилось, пока шел предыдущий коммит
+DB_WRITE_INTERVAL = float(os.getenv("DB_WRITE_INTERVAL", "0"))
+# Максимум записей в одной транзакции
+DB_WRITE_MAX_BATCH = int(os.getenv("DB_WRITE_MAX_BATCH", "200"))
+
+# --- ПЕРЕКОДИРОВАНИЕ КАРТИНОК ПЕРЕД ОТПРАВКОЙ ---
+# Формат для отправки: JPEG или WEBP
+IMG_ENCODE_FORMAT = os.getenv("IMG_ENCODE_FORMAT", "JPEG").upper()
+# Стартовое качество и нижняя граница, до которой можно опуститься ради лимита размера
+IMG_ENCODE_QUALITY = int(os.getenv("IMG_ENCODE_QUALITY", "85"))
+IMG_ENCODE_MIN_QUALITY = int(os.getenv("IMG_ENCODE_MIN_QUALITY", "60"))
+# Потолок размера файла, килобайт (0 — без потолка, только перекодирование)
+IMG_ENCODE_MAX_KB = int(os.getenv("IMG_ENCODE_MAX_KB", "300"))
+# Потоков для кодирования (CPU-работа вне event loop)
+IMG_ENCODE_WORKERS = int(os.getenv("IMG_ENCODE_WORKERS", "2"))
+# Оценка скорости отправки в Telegram для отчета о сэкономленном времени, килобит/с
+IMG_UPLOAD_KBPS = int(os.getenv("IMG_UPLOAD_KBPS", "8000"))
+# Кнопка "оригинал файлом" под картинкой и сколько последних оригиналов держим для нее в памяти
+IMG_SEND_AS_DOCUMENT = os.getenv("IMG_SEND_AS_DOCUMENT", "1") == "1"
+IMG_ORIGINALS_CACHE = int(os.getenv("IMG_ORIGINALS_CACHE", "100"))
+
+# --- ПОДПИСКА: КЭШ СТАТУСА И НАПОМИНАНИЯ ---
+# Сколько секунд держим в памяти дату окончания подписки (защищает от устаревания при отзыве премиума в другом процессе)
+PREMIUM_CACHE_TTL = float(os.getenv("PREMIUM_CACHE_TTL", "60"))
+PREMIUM_CACHE_MAX_SIZE = int(os.getenv("PREMIUM_CACHE_MAX_SIZE", "10000"))
+# За сколько дней до окончания напоминаем о продлении
+PREMIUM_REMIND_DAYS = float(os.getenv("PREMIUM_REMIND_DAYS", "3"))
+# Сообщение "подписка закончилась": ищем подписки, истекшие за последние N часов, а после простоя бота —
+# начиная с N часов до последней подписки, о которой уже сообщили (пропущенные за простой не теряются)
+PREMIUM_EXPIRED_WINDOW_HOURS = float(os.getenv("PREMIUM_EXPIRED_WINDOW_HOURS", "12"))
+# Как часто проверяем истекающие подписки, секунд, и сколько пользователей берем из базы за раз
+PREMIUM_REMIND_INTERVAL = float(os.getenv("PREMIUM_REMIND_INTERVAL", "600"))
+PREMIUM_REMIND_BATCH = int(os.getenv("PREMIUM_REMIND_BATCH", "100"))
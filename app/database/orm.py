@@ -1,19 +1,69 @@
 import os
 from datetime import datetime, timedelta
-from sqlalchemy import BigInteger, Integer, String, DateTime, Boolean, select, update, func
+from sqlalchemy import (
+    BigInteger, Integer, String, DateTime, Boolean, UniqueConstraint, select, update, delete, func, event, or_, and_
+)
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
-from sqlalchemy.ext.asyncio import AsyncAttrs, async_sessionmaker, create_async_engine
+from sqlalchemy.ext.asyncio import AsyncAttrs, AsyncSession, async_sessionmaker, create_async_engine
+
+from .writer import GroupCommitWriter
+from ..config import (
+    DB_READ_POOL_SIZE, DB_SYNCHRONOUS, DB_CACHE_MB, DB_MMAP_MB, DB_BUSY_TIMEOUT_MS,
+    DB_WRITE_INTERVAL, DB_WRITE_MAX_BATCH
+)
 
 # --- КОНФИГУРАЦИЯ ---
 # SQLite хранит базу в одном файле. Здесь мы указываем имя файла "bot.db"
 DATABASE_URL = "sqlite+aiosqlite:///bot.db"
 
-# Создаем движок
-# echo=False отключает вывод SQL-запросов в консоль (поставь True для отладки)
-engine = create_async_engine(DATABASE_URL, echo=False)
+def _tune_connection(dbapi_connection, connection_record):
+    """Настройки SQLite на каждое новое соединение"""
+    # Транзакциями управляем сами (см. _begin_immediate), иначе драйвер ломает SAVEPOINT
+    dbapi_connection.isolation_level = None
+    cursor = dbapi_connection.cursor()
+    # WAL: читатели не блокируют писателя и наоборот
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA synchronous={DB_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA cache_size=-{DB_CACHE_MB * 1024}")
+    cursor.execute(f"PRAGMA mmap_size={DB_MMAP_MB * 1024 * 1024}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    # Другие процессы бота (BOT_WORKERS > 1) пишут в тот же файл — ждем, а не падаем с "database is locked"
+    cursor.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    cursor.close()
+
+def _begin_immediate(conn):
+    # Сразу берем блокировку на запись, чтобы не упереться в нее посреди транзакции
+    conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+def _read_only(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA query_only=1")
+    cursor.close()
+
+def bind(url: str):
+    """Создает движки для базы url: писатель (одно соединение) и пул читателей"""
+    global engine, async_session, read_engine, read_session, writer
+
+    # echo=False отключает вывод SQL-запросов в консоль (поставь True для отладки)
+    engine = create_async_engine(url, echo=False, pool_size=1, max_overflow=0)
+    event.listen(engine.sync_engine, "connect", _tune_connection)
+    event.listen(engine.sync_engine, "begin", _begin_immediate)
+
+    read_engine = create_async_engine(url, echo=False, pool_size=DB_READ_POOL_SIZE, max_overflow=0)
+    event.listen(read_engine.sync_engine, "connect", _tune_connection)
+    event.listen(read_engine.sync_engine, "connect", _read_only)
+
+    # Фабрики сессий: async_session — для записи (ей пользуется писатель), read_session — для чтения
+    async_session = async_sessionmaker(engine, expire_on_commit=False)
+    read_session = async_sessionmaker(read_engine, expire_on_commit=False)
+    writer = GroupCommitWriter(async_session, interval=DB_WRITE_INTERVAL, max_batch=DB_WRITE_MAX_BATCH)
 
-# Создаем фабрику сессий
-async_session = async_sessionmaker(engine, expire_on_commit=False)
+async def dispose():
+    await engine.dispose()
+    await read_engine.dispose()
+
+bind(DATABASE_URL)
 
 class Base(AsyncAttrs, DeclarativeBase):
     pass
@@ -31,7 +81,8 @@ class User(Base):
     text_usage: Mapped[int] = mapped_column(Integer, default=0)
     image_usage: Mapped[int] = mapped_column(Integer, default=0)
     
-    premium_until: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+    # Индекс: подсчет и выборка активных/истекающих подписок
+    premium_until: Mapped[datetime] = mapped_column(DateTime, nullable=True, index=True)
     joined_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
 # --- МОДЕЛЬ ТАРИФОВ ---
@@ -45,16 +96,76 @@ class Tariff(Base):
     duration_days: Mapped[int] = mapped_column(Integer, nullable=False)
     is_active: Mapped[bool] = mapped_column(Boolean, default=True)
 
+# --- МОДЕЛЬ РАСХОДА ТОКЕНОВ ---
+# Одна строка на каждый запрос к нейросети: сколько токенов ушло и сколько он длился
+class TokenUsage(Base):
+    __tablename__ = 'token_usage'
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    telegram_id: Mapped[int] = mapped_column(BigInteger, index=True)
+    kind: Mapped[str] = mapped_column(String, nullable=False)  # 'text' или 'vision'
+    model: Mapped[str] = mapped_column(String, nullable=True)
+    prompt_tokens: Mapped[int] = mapped_column(Integer, default=0)
+    completion_tokens: Mapped[int] = mapped_column(Integer, default=0)
+    latency_ms: Mapped[int] = mapped_column(Integer, default=0)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+# Итоги по видам запросов: обновляются вместе с token_usage, чтобы админка не суммировала весь журнал
+class TokenTotals(Base):
+    __tablename__ = 'token_totals'
+
+    kind: Mapped[str] = mapped_column(String, primary_key=True)
+    requests: Mapped[int] = mapped_column(Integer, default=0)
+    prompt_tokens: Mapped[int] = mapped_column(BigInteger, default=0)
+    completion_tokens: Mapped[int] = mapped_column(BigInteger, default=0)
+
+# --- МОДЕЛЬ НАПОМИНАНИЙ О ПОДПИСКЕ ---
+# Одна строка на отправленное напоминание. premium_until входит в ключ:
+# после продления у подписки новая дата окончания, и напоминания о ней придут заново
+class PremiumReminder(Base):
+    __tablename__ = 'premium_reminders'
+    __table_args__ = (UniqueConstraint('telegram_id', 'kind', 'premium_until'),)
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    telegram_id: Mapped[int] = mapped_column(BigInteger)
+    kind: Mapped[str] = mapped_column(String, nullable=False)  # 'expiring' или 'expired'
+    premium_until: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    sent_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
 # --- ФУНКЦИИ ИНИЦИАЛИЗАЦИИ ---
 
 async def init_db():
     """Создает таблицы и файл базы данных, если их нет"""
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        # create_all не трогает уже существующие таблицы — новые индексы в старой базе создаем отдельно
+        await conn.run_sync(_create_missing_indexes)
+        await _backfill_token_totals(conn)
     
     # Создаем базовые тарифы
     await create_initial_tariffs()
 
+def _create_missing_indexes(conn):
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+async def _backfill_token_totals(conn):
+    """Разово считает итоги по журналу, накопленному до появления token_totals"""
+    if await conn.scalar(select(func.count()).select_from(TokenTotals)):
+        return
+    rows = (await conn.execute(
+        select(
+            TokenUsage.kind, func.count(),
+            func.sum(TokenUsage.prompt_tokens), func.sum(TokenUsage.completion_tokens)
+        ).group_by(TokenUsage.kind)
+    )).all()
+    for kind, requests, prompt_tokens, completion_tokens in rows:
+        await conn.execute(sqlite_insert(TokenTotals).values(
+            kind=kind, requests=requests,
+            prompt_tokens=prompt_tokens or 0, completion_tokens=completion_tokens or 0
+        ))
+
 async def create_initial_tariffs():
     async with async_session() as session:
         # Проверяем наличие тарифов
@@ -72,22 +183,37 @@ async def create_initial_tariffs():
         print("✅ Базовые тарифы созданы в SQLite (bot.db)")
 
 # --- ФУНКЦИИ ДЛЯ ЮЗЕРА ---
+# Чтение идет через пул read_session, запись — через writer.submit (групповой коммит)
 
 async def get_user(tg_id: int, username: str = None, full_name: str = None):
-    async with async_session() as session:
+    """Пользователь по telegram_id (создается при первом обращении); переданные имя и username обновляются"""
+    async with read_session() as session:
+        result = await session.execute(select(User).where(User.telegram_id == tg_id))
+        user = result.scalar_one_or_none()
+    if user:
+        # Пишем только при изменении профиля: обычный апдейт обходится одним чтением
+        if full_name is not None and (user.username, user.full_name) != (username, full_name):
+            await writer.submit(lambda session: session.execute(
+                update(User).where(User.telegram_id == tg_id).values(username=username, full_name=full_name)
+            ))
+            user.username, user.full_name = username, full_name
+        return user
+
+    async def create(session: AsyncSession):
+        # Проверяем еще раз: пока ждали писателя, юзера мог создать соседний апдейт
         result = await session.execute(select(User).where(User.telegram_id == tg_id))
         user = result.scalar_one_or_none()
         if not user:
             user = User(telegram_id=tg_id, username=username, full_name=full_name)
             session.add(user)
-            await session.commit()
-            # Обновляем объект, чтобы получить ID из базы
-            await session.refresh(user) 
-            return user
+            # Получаем ID из базы
+            await session.flush()
         return user
 
+    return await writer.submit(create)
+
 async def add_premium_time(tg_id: int, days: int):
-    async with async_session() as session:
+    async def extend(session: AsyncSession):
         result = await session.execute(select(User).where(User.telegram_id == tg_id))
         user = result.scalar_one_or_none()
         
@@ -102,61 +228,147 @@ async def add_premium_time(tg_id: int, days: int):
             
         # В SQLite обновление лучше делать через объект, но raw-update тоже работает
         user.premium_until = new_date
-        session.add(user)
-        await session.commit()
         return new_date
 
+    # Чтение и запись в одной транзакции писателя — два платежа подряд не потеряют дни
+    return await writer.submit(extend)
+
 async def increment_usage(tg_id: int, type: str):
-    async with async_session() as session:
-        # Вариант с прямым SQL update работает быстрее
-        field = User.text_usage if type == 'text' else User.image_usage
-        await session.execute(
-            update(User).where(User.telegram_id == tg_id).values({field: field + 1})
+    # Вариант с прямым SQL update работает быстрее
+    field = User.text_usage if type == 'text' else User.image_usage
+    await writer.submit(lambda session: session.execute(
+        update(User).where(User.telegram_id == tg_id).values({field: field + 1})
+    ))
+
+async def record_token_usage(tg_id: int, kind: str, model: str, prompt_tokens: int, completion_tokens: int, latency_ms: int):
+    async def add(session: AsyncSession):
+        session.add(TokenUsage(
+            telegram_id=tg_id,
+            kind=kind,
+            model=model,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            latency_ms=latency_ms
+        ))
+        # Итоги — в той же транзакции, что и строка журнала
+        totals = sqlite_insert(TokenTotals).values(
+            kind=kind, requests=1, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens
         )
-        await session.commit()
+        await session.execute(totals.on_conflict_do_update(
+            index_elements=[TokenTotals.kind],
+            set_={
+                "requests": TokenTotals.requests + 1,
+                "prompt_tokens": TokenTotals.prompt_tokens + prompt_tokens,
+                "completion_tokens": TokenTotals.completion_tokens + completion_tokens,
+            }
+        ))
+
+    await writer.submit(add)
 
 # --- ФУНКЦИИ ДЛЯ ТАРИФОВ ---
 
 async def get_active_tariffs():
-    async with async_session() as session:
+    async with read_session() as session:
         query = select(Tariff).where(Tariff.is_active == True).order_by(Tariff.price)
         result = await session.execute(query)
         return result.scalars().all()
 
 async def get_tariff_by_id(tariff_id: int):
-    async with async_session() as session:
+    async with read_session() as session:
         return await session.get(Tariff, tariff_id)
 
 async def get_all_users_ids():
-    async with async_session() as session:
+    async with read_session() as session:
         result = await session.execute(select(User.telegram_id))
         return result.scalars().all()
 
 async def remove_premium(tg_id: int):
-    async with async_session() as session:
-        past_date = datetime.utcnow() - timedelta(days=1)
-        await session.execute(
-            update(User).where(User.telegram_id == tg_id).values(premium_until=past_date)
+    past_date = datetime.utcnow() - timedelta(days=1)
+    await writer.submit(lambda session: session.execute(
+        update(User).where(User.telegram_id == tg_id).values(premium_until=past_date)
+    ))
+
+async def get_premium_to_remind(kind: str, start: datetime, end: datetime,
+                                after: tuple[datetime, int] = None, limit: int = 100):
+    """
+    Пользователи с premium_until в (start, end], которым еще не ушло напоминание kind.
+    Идет по индексу premium_until страницами: after — (premium_until, id) последней строки прошлой страницы.
+    """
+    reminded = select(PremiumReminder.id).where(
+        PremiumReminder.telegram_id == User.telegram_id,
+        PremiumReminder.kind == kind,
+        PremiumReminder.premium_until == User.premium_until
+    )
+    query = select(User.id, User.telegram_id, User.premium_until).where(
+        User.premium_until > start, User.premium_until <= end, ~reminded.exists()
+    )
+    if after:
+        until, user_id = after
+        query = query.where(or_(
+            User.premium_until > until,
+            and_(User.premium_until == until, User.id > user_id)
+        ))
+    query = query.order_by(User.premium_until, User.id).limit(limit)
+
+    async with read_session() as session:
+        result = await session.execute(query)
+        return result.all()
+
+async def claim_premium_reminder(tg_id: int, kind: str, premium_until: datetime) -> bool:
+    """Записывает напоминание до отправки. False — его уже отправили (в том числе из другого процесса)"""
+    query = sqlite_insert(PremiumReminder).values(
+        telegram_id=tg_id, kind=kind, premium_until=premium_until, sent_at=datetime.utcnow()
+    ).on_conflict_do_nothing()
+    result = await writer.submit(lambda session: session.execute(query))
+    return result.rowcount == 1
+
+async def release_premium_reminder(tg_id: int, kind: str, premium_until: datetime):
+    """Снимает запись о напоминании, которое не удалось отправить: следующая проверка попробует снова"""
+    await writer.submit(lambda session: session.execute(
+        delete(PremiumReminder).where(
+            PremiumReminder.telegram_id == tg_id,
+            PremiumReminder.kind == kind,
+            PremiumReminder.premium_until == premium_until
+        )
+    ))
+
+async def get_last_reminded_until(kind: str) -> datetime | None:
+    """Самая поздняя дата окончания подписки, о которой уже ушло напоминание kind"""
+    async with read_session() as session:
+        return await session.scalar(
+            select(func.max(PremiumReminder.premium_until)).where(PremiumReminder.kind == kind)
         )
-        await session.commit()
 
 async def get_stats():
     """
     Собирает полную статистику по боту.
     """
-    async with async_session() as session:
-        total_users = await session.scalar(select(func.count(User.id)))
+    async with read_session() as session:
+        # Читатели работают без транзакции (autocommit), и каждый SELECT видел бы свой снимок базы:
+        # пока групповой коммит пишет, итоги расходились бы между собой. Берем один снимок на все запросы,
+        # при возврате соединения в пул транзакция откатывается
+        conn = await session.connection()
+        await conn.exec_driver_sql("BEGIN")
+
+        # Счетчики по users одним проходом таблицы
+        totals = await session.execute(
+            select(func.count(User.id), func.sum(User.text_usage), func.sum(User.image_usage))
+        )
+        total_users, total_text, total_images = totals.one()
 
         active_premium = await session.scalar(
             select(func.count(User.id)).where(User.premium_until > datetime.utcnow())
         )
 
-        total_text = await session.scalar(select(func.sum(User.text_usage)))
-        total_images = await session.scalar(select(func.sum(User.image_usage)))
+        # Несколько строк итогов вместо прохода по всему журналу token_usage
+        total_tokens = await session.scalar(
+            select(func.sum(TokenTotals.prompt_tokens + TokenTotals.completion_tokens))
+        )
 
         return {
             "total_users": total_users or 0,
             "active_premium": active_premium or 0,
             "total_text": total_text or 0,
-            "total_images": total_images or 0
+            "total_images": total_images or 0,
+            "total_tokens": total_tokens or 0
         }
\ No newline at end of file
@@ -0,0 +1,94 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+WriteOp = Callable[[AsyncSession], Awaitable]
+
+
+class GroupCommitWriter:
+    """
+    Единственный писатель в SQLite. Запись из всех корутин копится в очереди
+    и коммитится пачкой: одна транзакция (и один fsync) на такт вместо одной на вызов.
+    """
+
+    def __init__(self, session_factory: async_sessionmaker, interval: float, max_batch: int):
+        self.session_factory = session_factory
+        self.interval = interval
+        self.max_batch = max_batch
+
+        self._queue: asyncio.Queue = None
+        self._task: asyncio.Task = None
+
+        self.commits = 0
+        self.writes = 0
+
+    def stats(self) -> dict:
+        return {
+            "queue": self._queue.qsize() if self._queue else 0,
+            "commits": self.commits,
+            "writes": self.writes,
+        }
+
+    async def submit(self, op: WriteOp):
+        """Выполняет op(session) в общей транзакции и возвращает ее результат после коммита"""
+        # Задача писателя привязана к event loop'у, поэтому запускаем ее при первой записи
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((op, future))
+        return await future
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            if self.interval:
+                # Ждем такт: за это время успеют прийти записи от соседних апдейтов
+                await asyncio.sleep(self.interval)
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            await self._commit(batch)
+
+    async def _commit(self, batch: list[tuple[WriteOp, asyncio.Future]]):
+        try:
+            try:
+                results = await self._apply(batch, isolated=False)
+            except Exception:
+                # Одна из записей упала — откатываем пачку и проводим каждую в своем SAVEPOINT,
+                # чтобы ошибка досталась только ее автору
+                results = await self._apply(batch, isolated=True)
+        except Exception as e:
+            logging.error(f"Групповой коммит ({len(batch)} записей) не удался: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.commits += 1
+        self.writes += len(batch)
+        for (_, future), (result, error) in zip(batch, results):
+            # Вызвавший мог отмениться (дедлайн) — запись все равно уже в базе
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    async def _apply(self, batch: list[tuple[WriteOp, asyncio.Future]], isolated: bool) -> list[tuple]:
+        results = []
+        async with self.session_factory() as session:
+            for op, _ in batch:
+                if not isolated:
+                    results.append((await op(session), None))
+                    continue
+                try:
+                    async with session.begin_nested():
+                        results.append((await op(session), None))
+                except Exception as e:
+                    results.append((None, e))
+            await session.commit()
+        return results
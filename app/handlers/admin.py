@@ -1,12 +1,24 @@
 import os
+import time
 import asyncio
 from aiogram import Router, F, types, Bot
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
+from aiogram.types import BufferedInputFile
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
+from ..database import orm
 from ..database.orm import get_stats, add_premium_time, remove_premium, get_all_users_ids
+from ..services.profiler import LoopProfiler
+from ..services.outbound import send_scheduler, bulk_sends
+from ..services.imaging import image_encoder
+from ..services.premium import invalidate_premium
+from ..services import sharding
+from .user import image_queue
+from ..config import (
+    BOT_WORKERS, PROFILE_DEFAULT_SECONDS, PROFILE_MAX_SECONDS, PROFILE_SAMPLE_INTERVAL, PROFILE_SLOW_CALLBACK, PROFILE_TOP_N
+)
 
 # --- ЧИТАЕМ СПИСОК АДМИНОВ ---
 # Разбиваем строку "id1,id2" на список чисел
@@ -16,6 +28,11 @@ ADMIN_IDS = [int(x) for x in admin_ids_str.split(",") if x.strip()]
 
 router = Router()
 
+# Сколько копий рассылки ставим в очередь отправки одновременно
+BROADCAST_BATCH = 30
+
+profiler = LoopProfiler(sample_interval=PROFILE_SAMPLE_INTERVAL, slow_callback=PROFILE_SLOW_CALLBACK)
+
 # --- СОСТОЯНИЯ (FSM) ---
 class AdminState(StatesGroup):
     waiting_for_user_id = State()      # Выдача: ждем ID
@@ -28,26 +45,53 @@ class AdminState(StatesGroup):
 def is_admin(message: types.Message):
     return message.from_user.id in ADMIN_IDS
 
-# --- 1. ГЛАВНОЕ МЕНЮ ---
-@router.message(Command("admin"))
-async def admin_menu(message: types.Message):
-    if not is_admin(message): return
+def process_scope() -> str:
+    """Чей профиль и счетчики показываем: у каждого воркера они свои, а админ попадает в воркер своего чата"""
+    if sharding.worker_index is None:
+        return ""
+    return f"только воркер {sharding.worker_index + 1} из {BOT_WORKERS} (тот, что обслуживает этот чат)"
 
+# --- 1. ГЛАВНОЕ МЕНЮ ---
+async def admin_panel_text(admin_id: int) -> str:
     stats = await get_stats()
-
-    text = (
+    send = send_scheduler.stats()
+    db = orm.writer.stats()
+    img = image_queue.stats()
+    enc = image_encoder.stats()
+    per_commit = db['writes'] / db['commits'] if db['commits'] else 0
+    totals = (
         f"👑 **Админ Панель**\n"
-        f"Вы вошли как: `{message.from_user.id}`\n\n"
+        f"Вы вошли как: `{admin_id}`\n\n"
         f"👥 Пользователей: `{stats['total_users']}`\n"
         f"🌟 Активных подписок: `{stats['active_premium']}`\n"
         f"📝 Текст. запросов: `{stats['total_text']}`\n"
-        f"🎨 Картинок: `{stats['total_images']}`"
+        f"🎨 Картинок: `{stats['total_images']}`\n"
+        f"🔢 Токенов: `{stats['total_tokens']}`\n\n"
+    )
+    # Все, что ниже, считает сам процесс (база выше — общая)
+    scope = process_scope()
+    if scope:
+        totals += f"⚙️ Ниже — {scope}, у остальных воркеров свои очереди и счетчики:\n"
+    return totals + (
+        f"📤 Очередь отправки: `{send['interactive_queue']}` ответов / `{send['bulk_queue']}` рассылки\n"
+        f"🚦 Ошибок 429: `{send['retry_after']}` из `{send['sent']}` отправок\n"
+        f"🖼 До первой картинки: p50 `{img['first_image_p50']:.1f}` с, p95 `{img['first_image_p95']:.1f}` с (превью показано `{img['previews_shown']}` раз)\n"
+        f"🗜 Сжатие картинок: `{enc['images']}` шт., −`{enc['saved_pct']:.0f}`% (`{enc['bytes_saved'] / 1024 / 1024:.1f}` МБ), "
+        f"кодирование avg `{enc['encode_ms_avg']:.0f}` мс, сэкономлено ~`{enc['ms_saved'] / 1000:.1f}` с загрузки\n"
+        f"💾 Запись в БД: `{db['writes']}` за `{db['commits']}` коммитов (~`{per_commit:.1f}` на коммит), в очереди `{db['queue']}`"
     )
 
+@router.message(Command("admin"))
+async def admin_menu(message: types.Message):
+    if not is_admin(message): return
+
+    text = await admin_panel_text(message.from_user.id)
+
     builder = InlineKeyboardBuilder()
     builder.button(text="🎁 Выдать Премиум", callback_data="admin_give_prem")
     builder.button(text="💀 Забрать Премиум", callback_data="admin_del_prem")
     builder.button(text="📢 Рассылка", callback_data="admin_broadcast")
+    builder.button(text=f"🔬 Профилирование ({PROFILE_DEFAULT_SECONDS} с)", callback_data="admin_profile")
     builder.button(text="🔄 Обновить", callback_data="admin_refresh")
     builder.adjust(1)
 
@@ -56,15 +100,7 @@ async def admin_menu(message: types.Message):
 @router.callback_query(F.data == "admin_refresh")
 async def refresh_stats(call: types.CallbackQuery):
     if call.from_user.id not in ADMIN_IDS: return
-    stats = await get_stats()
-    text = (
-        f"👑 **Админ Панель**\n"
-        f"Вы вошли как: `{call.from_user.id}`\n\n"
-        f"👥 Пользователей: `{stats['total_users']}`\n"
-        f"🌟 Активных подписок: `{stats['active_premium']}`\n"
-        f"📝 Текст. запросов: `{stats['total_text']}`\n"
-        f"🎨 Картинок: `{stats['total_images']}`"
-    )
+    text = await admin_panel_text(call.from_user.id)
     try:
         await call.message.edit_text(text, reply_markup=call.message.reply_markup)
         await call.answer("Обновлено")
@@ -96,6 +132,7 @@ async def process_give_days(message: types.Message, state: FSMContext):
         target_id = data['target_id']
         
         new_date = await add_premium_time(target_id, days)
+        invalidate_premium(target_id)
         await message.answer(f"✅ Премиум для `{target_id}` выдан до `{new_date.strftime('%d.%m.%Y')}`")
         await state.clear()
         
@@ -117,6 +154,7 @@ async def process_del_id(message: types.Message, state: FSMContext):
     try:
         uid = int(message.text)
         await remove_premium(uid)
+        invalidate_premium(uid)
         await message.answer(f"✅ Подписка пользователя `{uid}` аннулирована.")
         await state.clear()
     except:
@@ -155,14 +193,20 @@ async def execute_broadcast(call: types.CallbackQuery, state: FSMContext):
     users = await get_all_users_ids()
     await call.message.edit_text(f"🚀 Рассылка началась на {len(users)} пользователей...")
     
-    count = 0
-    for uid in users:
+    async def send(uid: int) -> bool:
         try:
             await call.bot.copy_message(chat_id=uid, from_chat_id=from_chat_id, message_id=msg_id)
-            count += 1
-            await asyncio.sleep(0.05)
-        except:
-            pass
+            return True
+        except Exception:
+            # Заблокировал бота / удалил аккаунт. 429 сюда не доходят — их переживает планировщик
+            return False
+
+    # Темп задает планировщик отправки: рассылка идет в фоновой очереди и не тормозит ответы юзерам
+    count = 0
+    with bulk_sends():
+        for i in range(0, len(users), BROADCAST_BATCH):
+            results = await asyncio.gather(*(send(uid) for uid in users[i:i + BROADCAST_BATCH]))
+            count += sum(results)
             
     await call.message.answer(f"🏁 Рассылка завершена. Доставлено: {count}")
     await state.clear()
@@ -170,4 +214,45 @@ async def execute_broadcast(call: types.CallbackQuery, state: FSMContext):
 @router.callback_query(AdminState.confirm_broadcast, F.data == "cancel_send")
 async def cancel_broadcast(call: types.CallbackQuery, state: FSMContext):
     await call.message.edit_text("❌ Рассылка отменена.")
-    await state.clear()
\ No newline at end of file
+    await state.clear()
+
+# --- 5. ПРОФИЛИРОВАНИЕ ---
+async def run_profiling(message: types.Message, seconds: int):
+    """Снимает профиль и присылает отчет + файл для flamegraph"""
+    if profiler.running:
+        return await message.answer("⏳ Профилирование уже идет, дождитесь отчета.")
+
+    scope = process_scope()
+    await message.answer(f"🔬 Профилирую {seconds} с" + (f", {scope}" if scope else "") + "...")
+    report = await profiler.run(seconds)
+
+    summary = report.summary(PROFILE_TOP_N)
+    if scope:
+        summary = f"🧩 Процесс: {scope}\n" + summary
+    await message.answer(summary, parse_mode=None)
+    if report.stacks:
+        file = BufferedInputFile(report.folded(), filename=f"profile-{int(time.time())}.folded")
+        await message.answer_document(
+            file,
+            caption="🔥 Collapsed stacks: flamegraph.pl, speedscope.app или inferno"
+        )
+
+@router.callback_query(F.data == "admin_profile")
+async def profile_button(call: types.CallbackQuery):
+    if call.from_user.id not in ADMIN_IDS: return
+    await call.answer()
+    await run_profiling(call.message, PROFILE_DEFAULT_SECONDS)
+
+@router.message(Command("profile"))
+async def profile_command(message: types.Message):
+    """/profile 60 — профилирование на 60 секунд"""
+    if not is_admin(message): return
+
+    args = message.text.split()
+    try:
+        seconds = int(args[1]) if len(args) > 1 else PROFILE_DEFAULT_SECONDS
+    except ValueError:
+        return await message.answer("Пример: `/profile 30`")
+
+    seconds = max(1, min(seconds, PROFILE_MAX_SECONDS))
+    await run_profiling(message, seconds)
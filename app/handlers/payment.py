@@ -48,7 +48,7 @@ async def process_buy_callback(call: types.CallbackQuery):
         return
 
     # Создаем ссылку на оплату через наш сервис
-    payment_url, payment_id = create_payment(
+    payment_url, payment_id = await create_payment(
         amount=tariff.price,
         description=f"Подписка: {tariff.name}",
         user_id=call.from_user.id,
@@ -3,15 +3,45 @@ from aiogram import Router, F, types, Bot
 from aiogram.filters import CommandStart, Command
 from aiogram.enums import ParseMode
 from aiogram.types import BufferedInputFile
+from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 # Проверь правильность путей к твоим файлам!
 # Если файлы лежат рядом, убери две точки: from database import ...
 from ..database.orm import get_user, increment_usage
 from ..services.ai_service import generate_text, generate_image_flux, analyze_image
-from datetime import datetime
+from ..services.debounce import MessageDebouncer
+from ..services.tokens import estimate_tokens, truncate_to_tokens
+from ..services.image_queue import ImageQueue, ImageJob, RenderSpec
+from ..services.deadline import call_with_retries, classify_telegram_error, deadline_scope, ExternalCallError
+from ..services.admission import AdmissionController
+from ..services.imaging import image_encoder
+from ..services.premium import premium_active
+from ..config import (
+    TEXT_DEBOUNCE_SECONDS,
+    MAX_PROMPT_TOKENS_FREE, MAX_PROMPT_TOKENS_PREMIUM, PROMPT_OVERFLOW_MODE,
+    MAX_OUTPUT_TOKENS_FREE, MAX_OUTPUT_TOKENS_PREMIUM,
+    IMG_WORKERS_PER_PROCESS, IMG_QUEUE_MAX_SIZE_PER_PROCESS, IMG_MAX_JOBS_PER_USER_FREE, IMG_MAX_JOBS_PER_USER_PREMIUM,
+    IMG_MAX_ATTEMPTS, IMG_RETRY_DELAY,
+    IMG_PROGRESSIVE, IMG_SIZE_FREE, IMG_SIZE_PREMIUM, IMG_MODEL_FREE, IMG_MODEL_PREMIUM, IMG_STEPS_FREE, IMG_STEPS_PREMIUM,
+    IMG_PREVIEW_SIZE_FREE, IMG_PREVIEW_SIZE_PREMIUM, IMG_PREVIEW_MODEL_FREE, IMG_PREVIEW_MODEL_PREMIUM,
+    IMG_PREVIEW_STEPS_FREE, IMG_PREVIEW_STEPS_PREMIUM, IMG_SEND_AS_DOCUMENT,
+    UPDATE_DEADLINE_SECONDS, IMG_JOB_DEADLINE_SECONDS,
+    ADMISSION_MAX_CONCURRENCY_PER_PROCESS, PREMIUM_RESERVED_SLOTS_PER_PROCESS, SHED_DEGRADE_WAIT, SHED_DEGRADE_QUEUE, SHED_REJECT_WAIT, SHED_REJECT_QUEUE,
+    DEGRADED_TEXT_MODEL,
+)
 
 router = Router()
 
+# Слоты на запросы к нейросети; решение "пускать ли" принимает AdmissionMiddleware
+admission = AdmissionController(
+    max_concurrency=ADMISSION_MAX_CONCURRENCY_PER_PROCESS,
+    premium_reserved=PREMIUM_RESERVED_SLOTS_PER_PROCESS,
+    degrade_wait=SHED_DEGRADE_WAIT,
+    degrade_queue=SHED_DEGRADE_QUEUE,
+    reject_wait=SHED_REJECT_WAIT,
+    reject_queue=SHED_REJECT_QUEUE
+)
+
 # --- ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ---
 
 async def send_chunked_response(message: types.Message, text: str):
@@ -42,6 +72,31 @@ async def send_chunked_response(message: types.Message, text: str):
                 chunk = text[x : x + MAX_LENGTH]
                 await message.answer(chunk)
 
+async def fit_prompt(message: types.Message, prompt: str, is_premium: bool):
+    """
+    Проверяет размер запроса по локальной оценке токенов.
+    Возвращает промпт (возможно, обрезанный) или None, если запрос отклонен.
+    """
+    limit = MAX_PROMPT_TOKENS_PREMIUM if is_premium else MAX_PROMPT_TOKENS_FREE
+    tokens = estimate_tokens(prompt)
+    if tokens <= limit:
+        return prompt
+
+    if PROMPT_OVERFLOW_MODE == "reject":
+        hint = "" if is_premium else "\nС подпиской лимит больше: /buy"
+        await message.answer(
+            f"⚠️ Слишком длинный запрос: ~{tokens} токенов при лимите {limit}.\n"
+            f"Сократите текст и попробуйте снова.{hint}"
+        )
+        return None
+
+    await message.answer(f"✂️ Запрос слишком длинный (~{tokens} токенов), обработаю только первые ~{limit}.")
+    return truncate_to_tokens(prompt, limit)
+
+def output_budget(is_premium: bool) -> int:
+    """Потолок длины ответа нейросети для тарифа"""
+    return MAX_OUTPUT_TOKENS_PREMIUM if is_premium else MAX_OUTPUT_TOKENS_FREE
+
 
 # --- ХЕНДЛЕРЫ ---
 
@@ -54,9 +109,7 @@ async def cmd_start(message: types.Message):
         full_name=message.from_user.full_name
     )
     
-    is_premium = False
-    if user.premium_until and user.premium_until > datetime.utcnow():
-        is_premium = True
+    is_premium = premium_active(user)
         
     if is_premium:
         status = f"🌟 Premium (до {user.premium_until.strftime('%d.%m.%Y')})"
@@ -80,54 +133,182 @@ async def cmd_start(message: types.Message):
         parse_mode=ParseMode.MARKDOWN
     )
 
+# Параметры рендера по тарифу: (полная картинка, превью)
+IMG_SPECS = {
+    False: (
+        RenderSpec(IMG_SIZE_FREE, IMG_MODEL_FREE, IMG_STEPS_FREE),
+        RenderSpec(IMG_PREVIEW_SIZE_FREE, IMG_PREVIEW_MODEL_FREE, IMG_PREVIEW_STEPS_FREE),
+    ),
+    True: (
+        RenderSpec(IMG_SIZE_PREMIUM, IMG_MODEL_PREMIUM, IMG_STEPS_PREMIUM),
+        RenderSpec(IMG_PREVIEW_SIZE_PREMIUM, IMG_PREVIEW_MODEL_PREMIUM, IMG_PREVIEW_STEPS_PREMIUM),
+    ),
+}
+
+async def render_image(prompt: str, spec: RenderSpec, seed: int) -> bytes:
+    return await generate_image_flux(prompt, size=spec.size, model=spec.model, steps=spec.steps, seed=seed)
+
+async def show_preview(job: ImageJob, img_data: bytes):
+    """Заменяет текстовую заглушку фото-превью; полная картинка потом встанет на его место"""
+    encoded = await image_encoder.encode(img_data, "preview")
+    file = BufferedInputFile(encoded.data, filename=encoded.filename)
+    job.preview_message = await job.message.answer_photo(file, caption="👀 Превью. Дорисовываю в полном качестве...")
+    await job.status.delete()
+
+def original_button(img_data: bytes):
+    """Кнопка "оригинал файлом": фото Telegram пережимает, документ приходит без потерь"""
+    if not IMG_SEND_AS_DOCUMENT:
+        return None
+    key = image_encoder.keep_original(img_data)
+    builder = InlineKeyboardBuilder()
+    builder.button(text="📎 Оригинал файлом", callback_data=f"img_doc:{key}")
+    return builder.as_markup()
+
+async def deliver_image(job: ImageJob, img_data: bytes):
+    """Отправляет готовую картинку (лимит списывает очередь после доставки)"""
+    encoded = await image_encoder.encode(img_data)
+    file = BufferedInputFile(encoded.data, filename=encoded.filename)
+    markup = original_button(img_data)
+    if job.preview_message:
+        await job.preview_message.edit_media(
+            types.InputMediaPhoto(media=file, caption=f"🎨 {job.prompt}"), reply_markup=markup
+        )
+    else:
+        await job.message.answer_photo(file, caption=f"🎨 {job.prompt}", reply_markup=markup)
+    if not job.preview_message:
+        try:
+            await job.status.delete()
+        except Exception:
+            # Картинка уже у пользователя, неудаленная заглушка — не ошибка доставки
+            pass
+
+async def charge_image(job: ImageJob):
+    await increment_usage(job.user_id, 'image')
+
+image_queue = ImageQueue(
+    render=render_image,
+    deliver=deliver_image,
+    show_preview=show_preview,
+    charge=charge_image,
+    workers=IMG_WORKERS_PER_PROCESS,
+    max_size=IMG_QUEUE_MAX_SIZE_PER_PROCESS,
+    max_attempts=IMG_MAX_ATTEMPTS,
+    retry_delay=IMG_RETRY_DELAY,
+    deadline=IMG_JOB_DEADLINE_SECONDS
+)
+
 @router.message(Command("img"))
-async def img_handler(message: types.Message):
+async def img_handler(message: types.Message, is_premium: bool = False):
     """Генерация картинок (Flux)"""
     prompt = message.text.replace("/img", "").strip()
     if not prompt: 
         return await message.answer("Пример: `/img кот в космосе`")
     
-    msg = await message.answer("🎨 Рисую (Flux)...")
-    
-    # Вызываем сервис генерации
-    img_data = await generate_image_flux(prompt)
-    
-    if img_data:
-        await increment_usage(message.from_user.id, 'image')
-        file = BufferedInputFile(img_data, filename="image.jpg")
-        await message.answer_photo(file, caption=f"🎨 {prompt}")
-        await msg.delete()
-    else:
-        await msg.edit_text("Ошибка генерации или сервис недоступен.")
+    msg = await message.answer("⏳ Ставлю в очередь...")
+
+    # Проверки и постановка в очередь идут без await между ними, иначе два /img подряд проскочат лимит
+    user_id = message.from_user.id
+    max_jobs = IMG_MAX_JOBS_PER_USER_PREMIUM if is_premium else IMG_MAX_JOBS_PER_USER_FREE
+    if image_queue.user_jobs(user_id) >= max_jobs:
+        return await msg.edit_text("⏳ Ваши картинки уже рисуются, дождитесь результата.")
+    if image_queue.is_full():
+        return await msg.edit_text("😔 Сейчас слишком много запросов на картинки. Попробуйте через пару минут.")
+
+    # Хендлер сразу освобождается, картинку нарисует воркер очереди
+    final, preview = IMG_SPECS[is_premium]
+    await image_queue.submit(ImageJob(
+        message=message, status=msg, prompt=prompt, user_id=user_id,
+        final=final, preview=preview if IMG_PROGRESSIVE else None
+    ))
+
+@router.callback_query(F.data.startswith("img_doc:"))
+async def send_original(call: types.CallbackQuery):
+    """Отправка оригинала картинки документом"""
+    original = image_encoder.original(call.data.split(":", 1)[1])
+    if original is None:
+        return await call.answer("Оригинал уже недоступен, сгенерируйте картинку заново.", show_alert=True)
+    await call.answer()
+    data, filename = original
+    await call.message.answer_document(BufferedInputFile(data, filename=filename))
 
 @router.message(F.photo)
-async def vision_handler(message: types.Message, bot: Bot):
+async def vision_handler(message: types.Message, bot: Bot, is_premium: bool = False):
     """Обработка фото (Vision)"""
+    # Подпись к фото — тот же промпт, проверяем его размер до скачивания
+    prompt = message.caption if message.caption else "Опиши подробно, что на фото."
+    prompt = await fit_prompt(message, prompt, is_premium)
+    if prompt is None:
+        return
+
     msg = await message.answer("👀 Смотрю...")
     
     # 1. Скачиваем фото правильно для aiogram 3.x
     photo = message.photo[-1] # Берем лучшее качество
-    file_io = io.BytesIO()
-    await bot.download(photo, destination=file_io)
-    file_bytes = file_io.getvalue()
-    
-    # 2. Формируем промпт
-    prompt = message.caption if message.caption else "Опиши подробно, что на фото."
+
+    async def download():
+        # Новый буфер на каждую попытку, чтобы не дописывать в обрывок предыдущей
+        file_io = io.BytesIO()
+        await bot.download(photo, destination=file_io)
+        return file_io.getvalue()
+
+    try:
+        file_bytes = await call_with_retries(download, "Telegram download", classify_telegram_error)
+    except Exception as e:
+        return await msg.edit_text(getattr(e, "user_text", None) or "Не удалось скачать фото.")
     
-    # 3. Отправляем в OpenRouter
-    answer = await analyze_image(prompt, file_bytes)
+    # 2. Отправляем в OpenRouter (слот занимаем только на время запроса)
+    try:
+        async with admission.slot(is_premium):
+            answer = await analyze_image(
+                prompt, file_bytes,
+                max_tokens=output_budget(is_premium),
+                user_id=message.from_user.id
+            )
+    except ExternalCallError as e:
+        # Запрос не выполнен — лимит не списываем
+        return await msg.edit_text(e.user_text or "Не удалось распознать изображение.")
     
     await increment_usage(message.from_user.id, 'text')
     await msg.delete()
     await send_chunked_response(message, answer)
 
+async def answer_text(messages: list[types.Message], is_premium: bool = False, degraded: bool = False):
+    """Отвечает на пачку подряд идущих сообщений одним запросом к нейросети"""
+    last = messages[-1]
+    prompt = await fit_prompt(last, "\n".join(m.text for m in messages), is_premium)
+    if prompt is None:
+        return
+
+    await last.bot.send_chat_action(last.chat.id, "typing")
+
+    # Склеенная пачка приходит из фона, поэтому бюджет времени открываем здесь
+    with deadline_scope(UPDATE_DEADLINE_SECONDS):
+        try:
+            async with admission.slot(is_premium):
+                # Просто передаем текст, сервис сам сформирует messages
+                answer = await generate_text(
+                    prompt,
+                    max_tokens=output_budget(is_premium),
+                    user_id=last.from_user.id,
+                    # При перегрузке free-запросы уходят в более дешевую модель, если она задана
+                    model=DEGRADED_TEXT_MODEL if degraded else None
+                )
+        except ExternalCallError as e:
+            # Ответа нет — лимит не списываем
+            return await last.answer(e.user_text or "Произошла ошибка при генерации текста. Попробуйте позже.")
+
+    # Один ответ — одно списание, сколько бы сообщений ни склеилось
+    await increment_usage(last.from_user.id, 'text')
+    await send_chunked_response(last, answer)
+
+text_debouncer = MessageDebouncer(TEXT_DEBOUNCE_SECONDS, answer_text)
+
 @router.message(F.text)
-async def text_handler(message: types.Message):
+async def text_handler(message: types.Message, is_premium: bool = False, degraded: bool = False):
     """Обычный текстовый запрос"""
-    await message.bot.send_chat_action(message.chat.id, "typing")
-    
-    # Просто передаем текст, сервис сам сформирует messages
-    answer = await generate_text(message.text)
-    
-    await increment_usage(message.from_user.id, 'text')
-    await send_chunked_response(message, answer)
\ No newline at end of file
+    if TEXT_DEBOUNCE_SECONDS > 0:
+        # Ждем паузы в переписке, ответ уйдет из debouncer'а
+        text_debouncer.push(message, is_premium=is_premium, degraded=degraded)
+        return
+
+    await answer_text([message], is_premium=is_premium, degraded=degraded)
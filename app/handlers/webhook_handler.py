@@ -5,6 +5,7 @@ from yookassa.domain.notification import WebhookNotificationFactory
 
 # Импортируем функцию выдачи премиума из базы
 from ..database.orm import add_premium_time
+from ..services.premium import invalidate_premium
 
 async def yookassa_webhook(request: web.Request):
     """
@@ -34,6 +35,7 @@ async def yookassa_webhook(request: web.Request):
 
             # 3. Выдаем подписку в БД
             new_date = await add_premium_time(user_id, duration)
+            invalidate_premium(user_id)
             
             # 4. Уведомляем пользователя через бота
             # Достаем бота из "контекста" приложения
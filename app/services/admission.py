@@ -0,0 +1,125 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+from .deadline import current_deadline, DeadlineExceeded
+
+# Стадии перегрузки
+NORMAL = 0    # Все запросы обслуживаются как обычно
+DEGRADE = 1   # Free-запросы ждут за премиумом, получают "занято" и (опционально) дешевую модель
+REJECT = 2    # Free-запросы отклоняются сразу, премиум обслуживается
+
+STAGE_NAMES = {NORMAL: "normal", DEGRADE: "degrade", REJECT: "reject"}
+
+
+class AdmissionController:
+    """
+    Ограничивает число одновременных запросов к нейросети и решает,
+    пускать ли новый запрос, глядя на очередь ожидания и число запросов в работе.
+    """
+
+    def __init__(self, max_concurrency: int, premium_reserved: int,
+                 degrade_wait: float, degrade_queue: int,
+                 reject_wait: float, reject_queue: int):
+        self.max_concurrency = max_concurrency
+        # Free занимает слоты только до этой границы, остаток — резерв премиума.
+        # Иначе медленный провайдер держит все слоты free-запросами, и премиум ждет их окончания
+        self.free_limit = max_concurrency - premium_reserved
+        self.degrade_wait = degrade_wait
+        self.degrade_queue = degrade_queue
+        self.reject_wait = reject_wait
+        self.reject_queue = reject_queue
+
+        self.in_flight = 0
+        # Ожидающие слота: (время постановки, future). Премиум всегда обслуживается первым
+        self._premium: deque[tuple[float, asyncio.Future]] = deque()
+        self._free: deque[tuple[float, asyncio.Future]] = deque()
+        self._last_stage = NORMAL
+
+    # --- МЕТРИКИ ---
+
+    def waiting(self) -> int:
+        return len(self._premium) + len(self._free)
+
+    def oldest_wait(self) -> float:
+        """Сколько секунд ждет самый старый запрос в очереди"""
+        now = time.monotonic()
+        ages = [now - queue[0][0] for queue in (self._premium, self._free) if queue]
+        return max(ages, default=0.0)
+
+    def stage(self) -> int:
+        wait = self.oldest_wait()
+        waiting = self.waiting()
+
+        if wait >= self.reject_wait or waiting >= self.reject_queue:
+            stage = REJECT
+        elif wait >= self.degrade_wait or waiting >= self.degrade_queue or self.in_flight >= self.free_limit:
+            stage = DEGRADE
+        else:
+            stage = NORMAL
+
+        if stage != self._last_stage:
+            logging.warning(
+                f"Admission: {STAGE_NAMES[self._last_stage]} -> {STAGE_NAMES[stage]} "
+                f"(в работе {self.in_flight}, в очереди {waiting}, ожидание {wait:.1f}с)"
+            )
+            self._last_stage = stage
+        return stage
+
+    # --- СЛОТЫ ---
+
+    @asynccontextmanager
+    async def slot(self, premium: bool):
+        """Занимает слот на время запроса к нейросети"""
+        await self._acquire(premium)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _limit(self, premium: bool) -> int:
+        return self.max_concurrency if premium else self.free_limit
+
+    async def _acquire(self, premium: bool):
+        # Премиум не стоит за ожидающими free: ему важна только своя очередь
+        ahead = self._premium if premium else self.waiting()
+        if self.in_flight < self._limit(premium) and not ahead:
+            self.in_flight += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (time.monotonic(), future)
+        queue = self._premium if premium else self._free
+        queue.append(entry)
+
+        try:
+            # Ждем не дольше, чем позволяет дедлайн апдейта
+            async with asyncio.timeout(current_deadline().remaining()):
+                await future
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                # Слот успели выдать одновременно с таймаутом — возвращаем его
+                self._release()
+            elif entry in queue:
+                queue.remove(entry)
+            if isinstance(e, TimeoutError):
+                raise DeadlineExceeded("Очередь к нейросети: бюджет времени исчерпан")
+            raise
+
+    def _release(self):
+        self.in_flight -= 1
+        # Передаем освободившиеся слоты ожидающим: сначала премиум, потом free (в пределах его доли)
+        while True:
+            if self._premium and self.in_flight < self.max_concurrency:
+                queue = self._premium
+            elif self._free and self.in_flight < self.free_limit:
+                queue = self._free
+            else:
+                return
+            _, future = queue.popleft()
+            if future.done():
+                continue
+            self.in_flight += 1
+            future.set_result(None)
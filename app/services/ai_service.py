@@ -1,8 +1,17 @@
 import os
+import time
+import asyncio
 import base64
 import aiohttp
 import logging
-from openai import AsyncOpenAI
+import openai
+from openai import AsyncOpenAI, NOT_GIVEN
+
+from ..database.orm import record_token_usage
+from ..config import IMG_ATTEMPT_TIMEOUT
+from .deadline import (
+    call_with_retries, ExternalCallError, UpstreamTimeout, RateLimited, UpstreamUnavailable
+)
 
 # Получи ключ: https://openrouter.ai/keys
 SYSTEM_PROMPT = """
@@ -26,21 +35,73 @@ APP_NAME = "My Telegram Bot"
 client = AsyncOpenAI(
     api_key=OPENROUTER_API_KEY,
     base_url="https://api.groq.com/openai/v1",
+    # Повторы и таймауты делаем сами (call_with_retries) в рамках дедлайна апдейта
+    max_retries=0,
 )
 
 # Модели
 TEXT_MODEL = "meta-llama/llama-4-scout-17b-16e-instruct" # Или "openai/gpt-4o-mini"
 VISION_MODEL = "meta-llama/llama-4-scout-17b-16e-instruct"
 
-async def generate_text(user_prompt: str) -> str:
-    """Генерация текста через OpenRouter с системным промтом"""
+def _retry_after(response) -> float:
+    try:
+        return float(response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+def _classify_openai_error(e: Exception):
+    """Переводит ошибки OpenAI SDK в наши типы"""
+    if isinstance(e, openai.APITimeoutError):
+        return UpstreamTimeout(str(e))
+    if isinstance(e, openai.RateLimitError):
+        return RateLimited(str(e), retry_after=_retry_after(e.response))
+    if isinstance(e, (openai.InternalServerError, openai.APIConnectionError)):
+        return UpstreamUnavailable(str(e))
+    if isinstance(e, openai.APIStatusError):
+        # Остальные 4xx повторять бессмысленно
+        return ExternalCallError(str(e))
+    return None
+
+def _classify_aiohttp_error(e: Exception):
+    if isinstance(e, aiohttp.ClientError):
+        return UpstreamUnavailable(str(e))
+    return None
+
+# Фоновые записи расхода токенов (держим ссылки, чтобы задачи не собрал GC)
+_usage_writes: set[asyncio.Task] = set()
+
+def _record_usage(user_id: int, kind: str, model: str, completion, started: float):
+    """Сохраняет фактический расход токенов из ответа API (usage) в фоне — ответ пользователю его не ждет"""
+    if user_id is None:
+        return
+    latency_ms = int((time.monotonic() - started) * 1000)
+    usage = completion.usage
+    task = asyncio.create_task(_write_usage(
+        user_id, kind, model,
+        prompt_tokens=usage.prompt_tokens if usage else 0,
+        completion_tokens=usage.completion_tokens if usage else 0,
+        latency_ms=latency_ms
+    ))
+    _usage_writes.add(task)
+    task.add_done_callback(_usage_writes.discard)
+
+async def _write_usage(user_id: int, kind: str, model: str, **usage):
     try:
-        completion = await client.chat.completions.create(
+        await record_token_usage(user_id, kind, model, **usage)
+    except Exception as e:
+        logging.error(f"Token usage record error: {e}")
+
+async def generate_text(user_prompt: str, max_tokens: int = None, user_id: int = None, model: str = None) -> str:
+    """Генерация текста через OpenRouter с системным промтом (при ошибке — ExternalCallError)"""
+    model = model or TEXT_MODEL
+    try:
+        started = time.monotonic()
+        completion = await call_with_retries(lambda: client.chat.completions.create(
             extra_headers={
                 "HTTP-Referer": SITE_URL,
                 "X-Title": APP_NAME,
             },
-            model=TEXT_MODEL,
+            model=model,
             messages=[
                 # 1. Сначала даем инструкцию "кто ты"
                 {"role": "system", "content": SYSTEM_PROMPT},
@@ -48,20 +109,26 @@ async def generate_text(user_prompt: str) -> str:
                 {"role": "user", "content": user_prompt}
             ],
             temperature=0.7, # 0.7 - баланс между креативностью и точностью
-        )
+            max_tokens=max_tokens or NOT_GIVEN,
+        ), "LLM text", _classify_openai_error)
         logging.info(f"OpenRouter Response: {completion}")
+        _record_usage(user_id, 'text', model, completion, started)
         return completion.choices[0].message.content
     except Exception as e:
-        print(f"Text Error: {e}")
-        return "Произошла ошибка при генерации текста. Попробуйте позже."
+        print(f"Text Error [{getattr(e, 'kind', 'unknown')}]: {e}")
+        # Наружу — только ExternalCallError: по нему хендлер понимает, что лимит списывать не за что
+        if isinstance(e, ExternalCallError):
+            raise
+        raise ExternalCallError(str(e)) from e
 
-async def analyze_image(prompt: str, image_bytes: bytes) -> str:
-    """Анализ изображения (Vision)"""
+async def analyze_image(prompt: str, image_bytes: bytes, max_tokens: int = None, user_id: int = None) -> str:
+    """Анализ изображения (Vision), при ошибке — ExternalCallError"""
     try:
+        started = time.monotonic()
         # Кодируем байты в base64 строку
         base64_image = base64.b64encode(image_bytes).decode('utf-8')
 
-        completion = await client.chat.completions.create(
+        completion = await call_with_retries(lambda: client.chat.completions.create(
             extra_headers={
                 "HTTP-Referer": SITE_URL,
                 "X-Title": APP_NAME,
@@ -80,31 +147,51 @@ async def analyze_image(prompt: str, image_bytes: bytes) -> str:
                         }
                     ]
                 }
-            ]
-        )
+            ],
+            max_tokens=max_tokens or NOT_GIVEN,
+        ), "LLM vision", _classify_openai_error)
+        _record_usage(user_id, 'vision', VISION_MODEL, completion, started)
         return completion.choices[0].message.content
     except Exception as e:
-        print(f"Vision Error: {e}")
-        return "Не удалось распознать изображение."
+        print(f"Vision Error [{getattr(e, 'kind', 'unknown')}]: {e}")
+        # Наружу — только ExternalCallError: по нему хендлер понимает, что лимит списывать не за что
+        if isinstance(e, ExternalCallError):
+            raise
+        raise ExternalCallError(str(e)) from e
 
-async def generate_image_flux(prompt: str) -> bytes:
+async def generate_image_flux(prompt: str, size: int = 1024, model: str = "flux",
+                              steps: int = 0, seed: int = None) -> bytes:
     """
     Генерация картинки Flux. 
     Используем Pollinations.ai (бесплатно и качественно), 
     так как через OpenRouter генерация картинок сложнее в настройке.
+    Одинаковый seed дает превью и полную картинку с одной и той же композицией.
     """
     try:
         # Кодируем промпт для URL
         encoded_prompt = prompt.replace(" ", "%20")
-        url = f"https://image.pollinations.ai/prompt/{encoded_prompt}?model=flux&width=1024&height=1024&nologo=true"
+        url = f"https://image.pollinations.ai/prompt/{encoded_prompt}?model={model}&width={size}&height={size}&nologo=true"
+        if seed is not None:
+            url += f"&seed={seed}"
+        if steps:
+            url += f"&steps={steps}"
         
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as resp:
-                if resp.status == 200:
-                    return await resp.read() # Возвращаем байты картинки
-                else:
-                    print(f"Flux Error: Status {resp.status}")
-                    return None
+        async def fetch():
+            async with aiohttp.ClientSession() as session:
+                async with session.get(url) as resp:
+                    if resp.status == 200:
+                        return await resp.read() # Возвращаем байты картинки
+                    if resp.status == 429:
+                        raise RateLimited("Pollinations: 429", retry_after=_retry_after(resp))
+                    if resp.status >= 500:
+                        raise UpstreamUnavailable(f"Pollinations: status {resp.status}")
+                    raise ExternalCallError(f"Pollinations: status {resp.status}")
+
+        # Одна попытка: повторы делает очередь картинок (ImageQueue), второй слой лишь умножил бы запросы
+        return await call_with_retries(
+            fetch, "Pollinations", _classify_aiohttp_error,
+            max_attempts=1, attempt_timeout=IMG_ATTEMPT_TIMEOUT
+        )
     except Exception as e:
-        print(f"Flux Generate Error: {e}")
-        return None
\ No newline at end of file
+        print(f"Flux Generate Error [{getattr(e, 'kind', 'unknown')}]: {e}")
+        return None
@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Optional
+
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+
+from ..config import (
+    UPDATE_DEADLINE_SECONDS, EXTERNAL_MAX_ATTEMPTS, EXTERNAL_RETRY_BASE_DELAY, EXTERNAL_ATTEMPT_TIMEOUT
+)
+
+# --- ТИПИЗИРОВАННЫЕ ОШИБКИ ВНЕШНИХ ВЫЗОВОВ ---
+
+class ExternalCallError(Exception):
+    """Ошибка внешнего сервиса (нейросеть, Pollinations, ЮKassa, Telegram)"""
+    kind = "error"
+    retryable = False
+    # Текст для пользователя; None — пусть вызывающий код покажет свое сообщение
+    user_text = None
+
+class UpstreamTimeout(ExternalCallError):
+    kind = "timeout"
+    retryable = True
+    user_text = "⏱ Сервис не ответил вовремя. Попробуйте позже."
+
+class DeadlineExceeded(UpstreamTimeout):
+    """Бюджет времени на апдейт исчерпан — повторять уже некогда"""
+    retryable = False
+
+class RateLimited(ExternalCallError):
+    kind = "rate_limit"
+    retryable = True
+    user_text = "🚦 Сервис перегружен запросами. Попробуйте через минуту."
+
+    def __init__(self, message: str, retry_after: float = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class UpstreamUnavailable(ExternalCallError):
+    """5xx или обрыв соединения"""
+    kind = "upstream_5xx"
+    retryable = True
+    user_text = "🔧 Сервис временно недоступен. Попробуйте позже."
+
+# --- БЮДЖЕТ ВРЕМЕНИ (DEADLINE) ---
+
+class Deadline:
+    def __init__(self, seconds: float):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+# Дедлайн текущего апдейта; asyncio копирует контекст в дочерние задачи
+_current_deadline: ContextVar[Optional[Deadline]] = ContextVar("deadline", default=None)
+
+@contextmanager
+def deadline_scope(seconds: float):
+    """
+    Открывает бюджет времени для всех внешних вызовов внутри блока.
+    Вложенный бюджет не может быть длиннее внешнего.
+    """
+    deadline = Deadline(seconds)
+    outer = _current_deadline.get()
+    if outer and outer.expires_at < deadline.expires_at:
+        deadline = outer
+
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
+
+def current_deadline() -> Deadline:
+    """Дедлайн текущего апдейта, а вне апдейта — свежий бюджет по умолчанию"""
+    return _current_deadline.get() or Deadline(UPDATE_DEADLINE_SECONDS)
+
+# --- ПОВТОРЫ ---
+
+def classify_telegram_error(e: Exception) -> Optional[ExternalCallError]:
+    if isinstance(e, TelegramRetryAfter):
+        return RateLimited(str(e), retry_after=e.retry_after)
+    if isinstance(e, (TelegramServerError, TelegramNetworkError)):
+        return UpstreamUnavailable(str(e))
+    return None
+
+async def call_with_retries(
+    op: Callable[[], Awaitable],
+    name: str,
+    classify: Callable[[Exception], Optional[ExternalCallError]] = None,
+    max_attempts: int = EXTERNAL_MAX_ATTEMPTS,
+    attempt_timeout: float = EXTERNAL_ATTEMPT_TIMEOUT,
+):
+    """
+    Выполняет идемпотентную операцию `op` в рамках текущего дедлайна.
+    Каждая попытка длится не дольше `attempt_timeout`, чтобы зависший вызов не съел весь бюджет.
+    Таймауты, 429 и 5xx повторяются с экспоненциальной паузой и jitter,
+    пока хватает бюджета. Наружу летит ExternalCallError нужного типа.
+    `classify` переводит исключения библиотеки в наши типы (None — не наша ошибка).
+    """
+    deadline = current_deadline()
+    attempt = 0
+    while True:
+        attempt += 1
+        remaining = deadline.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded(f"{name}: бюджет времени исчерпан")
+        budget = min(remaining, attempt_timeout)
+
+        try:
+            async with asyncio.timeout(budget):
+                return await op()
+        except TimeoutError:
+            error = UpstreamTimeout(f"{name}: нет ответа за {budget:.1f}с")
+        except ExternalCallError as e:
+            error = e
+        except Exception as e:
+            error = classify(e) if classify else None
+            if error is None:
+                raise
+
+        if not error.retryable or attempt >= max_attempts:
+            raise error
+
+        # Full jitter: случайная пауза от 0 до base * 2^n, чтобы повторы не шли волной
+        delay = random.uniform(0, EXTERNAL_RETRY_BASE_DELAY * 2 ** (attempt - 1))
+        if isinstance(error, RateLimited) and error.retry_after:
+            delay = max(delay, error.retry_after)
+        if delay >= deadline.remaining():
+            raise error
+
+        logging.warning(f"{name}: {error.kind} ({error}), повтор {attempt + 1}/{max_attempts} через {delay:.1f}с")
+        await asyncio.sleep(delay)
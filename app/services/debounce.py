@@ -0,0 +1,99 @@
+import asyncio
+import contextvars
+import logging
+from typing import Awaitable, Callable
+
+from aiogram import types
+
+FlushCallback = Callable[..., Awaitable[None]]
+# Пачка — это сообщения одного автора в одном чате: в группе тексты разных людей не смешиваются
+BatchKey = tuple[int, int]
+
+
+def batch_key(message: types.Message) -> BatchKey:
+    return message.chat.id, message.from_user.id if message.from_user else 0
+
+
+class MessageDebouncer:
+    """
+    Копит сообщения одного автора в чате, пока они приходят чаще, чем раз в `delay` секунд,
+    и отдает их пачкой в `on_flush(messages, **context)`, когда наступает тишина.
+    """
+
+    def __init__(self, delay: float, on_flush: FlushCallback):
+        self.delay = delay
+        self.on_flush = on_flush
+        self._pending: dict[BatchKey, list[types.Message]] = {}
+        self._context: dict[BatchKey, dict] = {}
+        self._timers: dict[BatchKey, asyncio.Task] = {}
+        # Замок на автора в чате: следующая пачка не уйдет в нейросеть, пока не отвечена предыдущая
+        self._locks: dict[BatchKey, asyncio.Lock] = {}
+        self._lock_users: dict[BatchKey, int] = {}
+        # Держим ссылки на запущенные отправки, чтобы задачи не собрал GC
+        self._flushing: set[asyncio.Task] = set()
+
+    def push(self, message: types.Message, **context):
+        """Добавляет сообщение в буфер автора и перезапускает таймер тишины"""
+        key = batch_key(message)
+        self._pending.setdefault(key, []).append(message)
+        # Контекст (например, тариф) берем от последнего сообщения пачки — автор у пачки один
+        self._context[key] = context
+
+        timer = self._timers.get(key)
+        if timer:
+            timer.cancel()
+        # Таймер стартует с чистым контекстом: пачка не должна наследовать дедлайн первого апдейта
+        self._timers[key] = asyncio.create_task(
+            self._wait_and_flush(key), context=contextvars.Context()
+        )
+
+    def flush(self, message: types.Message) -> bool:
+        """
+        Отправляет накопленные сообщения автора сразу, не дожидаясь тишины (например, пришла команда).
+        Пачка закрывается до возврата: сообщения после этого вызова пойдут уже в следующую.
+        """
+        key = batch_key(message)
+        if key not in self._pending:
+            return False
+        timer = self._timers.pop(key, None)
+        if timer:
+            timer.cancel()
+        messages, context = self._pending.pop(key), self._context.pop(key, {})
+        # Как и у таймера — чистый контекст, без дедлайна апдейта с командой
+        task = asyncio.create_task(self._flush(key, messages, context), context=contextvars.Context())
+        self._flushing.add(task)
+        task.add_done_callback(self._flushing.discard)
+        return True
+
+    async def _wait_and_flush(self, key: BatchKey):
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            return
+
+        # С этого момента пачка "закрыта": новые сообщения пойдут в следующую
+        task = self._timers.pop(key, None)
+        if task:
+            self._flushing.add(task)
+            task.add_done_callback(self._flushing.discard)
+        messages = self._pending.pop(key, [])
+        context = self._context.pop(key, {})
+        if messages:
+            await self._flush(key, messages, context)
+
+    async def _flush(self, key: BatchKey, messages: list[types.Message], context: dict):
+        # Апдейты обрабатываются параллельно, поэтому восстанавливаем порядок по message_id
+        messages.sort(key=lambda m: m.message_id)
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        self._lock_users[key] = self._lock_users.get(key, 0) + 1
+        try:
+            async with lock:
+                await self.on_flush(messages, **context)
+        except Exception as e:
+            logging.error(f"Debounce flush error (chat {key[0]}, user {key[1]}): {e}")
+        finally:
+            self._lock_users[key] -= 1
+            if not self._lock_users[key]:
+                del self._lock_users[key]
+                del self._locks[key]
@@ -0,0 +1,233 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Optional
+
+from aiogram import types
+
+from .deadline import deadline_scope
+from .outbound import bulk_sends
+
+
+
+@dataclass(frozen=True)
+class RenderSpec:
+    """Параметры одного рендера: сторона картинки, модель и число шагов (0 — по умолчанию)"""
+    size: int
+    model: str
+    steps: int = 0
+
+
+RenderCallback = Callable[[str, RenderSpec, int], Awaitable[Optional[bytes]]]
+DeliverCallback = Callable[["ImageJob", bytes], Awaitable[None]]
+ChargeCallback = Callable[["ImageJob"], Awaitable[None]]
+
+
+@dataclass(eq=False)
+class ImageJob:
+    message: types.Message  # Исходное сообщение с командой /img
+    status: types.Message   # Сообщение-заглушка, в котором показываем прогресс
+    prompt: str
+    user_id: int
+    final: RenderSpec
+    preview: Optional[RenderSpec] = None  # None — без превью, сразу полная картинка
+    # Общий seed превью и полной картинки, чтобы они совпадали по композиции
+    seed: int = field(default_factory=lambda: random.randint(0, 2**31 - 1))
+    # Фото-сообщение с превью; когда оно есть, статус и итог показываем в нем
+    preview_message: Optional[types.Message] = None
+    # Правки статуса одной задачи идут строго по очереди, иначе "в очереди" может затереть "рисую"
+    status_lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    shown_position: int = 0
+    # Момент постановки; обнуляется, когда пользователь увидел первую картинку
+    submitted_at: Optional[float] = field(default_factory=time.monotonic)
+
+
+class ImageQueue:
+    """
+    Очередь генерации картинок с фиксированным числом воркеров.
+    Хендлер только ставит задачу и сразу освобождается, а рисование идет в фоне.
+    """
+
+    def __init__(self, render: RenderCallback, deliver: DeliverCallback, show_preview: DeliverCallback,
+                 charge: ChargeCallback, workers: int, max_size: int, max_attempts: int, retry_delay: float,
+                 deadline: float):
+        self.render = render
+        self.deliver = deliver
+        self.show_preview = show_preview
+        # Списание лимита: только когда у пользователя осталась картинка (полная или превью)
+        self.charge = charge
+        self.workers = workers
+        self.max_size = max_size
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        # Бюджет времени на задачу целиком, со всеми повторами
+        self.deadline = deadline
+
+        self._queue: asyncio.Queue[ImageJob] = asyncio.Queue()
+        # Ожидающие задачи по порядку — по ним считаем позицию в очереди
+        self._waiting: list[ImageJob] = []
+        self._per_user: dict[int, int] = {}
+        self._tasks: list[asyncio.Task] = []
+        self._refreshes: set[asyncio.Task] = set()
+        # Время от /img до первой картинки у пользователя (превью или полной) по последним задачам
+        self._first_image_times: deque[float] = deque(maxlen=200)
+        self.previews_shown = 0
+
+    def start(self):
+        """Запускает воркеры (вызывать при старте приложения)"""
+        if self._tasks:
+            return
+        for i in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(i)))
+
+    def user_jobs(self, user_id: int) -> int:
+        return self._per_user.get(user_id, 0)
+
+    def is_full(self) -> bool:
+        return len(self._waiting) >= self.max_size
+
+    def stats(self) -> dict:
+        times = sorted(self._first_image_times)
+        return {
+            "waiting": len(self._waiting),
+            "first_image_p50": times[len(times) // 2] if times else 0.0,
+            "first_image_p95": times[min(len(times) - 1, int(len(times) * 0.95))] if times else 0.0,
+            "previews_shown": self.previews_shown,
+        }
+
+    async def submit(self, job: ImageJob):
+        """Ставит задачу в очередь и показывает пользователю его позицию"""
+        self._waiting.append(job)
+        self._per_user[job.user_id] = self._per_user.get(job.user_id, 0) + 1
+        self._queue.put_nowait(job)
+        await self._show_position(job)
+
+    async def _show_position(self, job: ImageJob):
+        async with job.status_lock:
+            # Позицию считаем в момент правки: задачу могли уже взять в работу
+            if job not in self._waiting:
+                return
+            position = self._waiting.index(job) + 1
+            if position == job.shown_position:
+                return
+            job.shown_position = position
+            try:
+                await job.status.edit_text(f"⏳ В очереди на генерацию: {position}-й")
+            except Exception:
+                pass
+
+    async def _refresh_positions(self):
+        # Обновление позиций — служебные правки, пропускаем вперед ответы пользователям
+        with bulk_sends():
+            for job in list(self._waiting):
+                await self._show_position(job)
+
+    async def _set_status(self, job: ImageJob, text: str):
+        async with job.status_lock:
+            try:
+                if job.preview_message:
+                    await job.preview_message.edit_caption(caption=text)
+                else:
+                    await job.status.edit_text(text)
+            except Exception:
+                # "message is not modified" и удаленные сообщения не критичны
+                pass
+
+    async def _worker(self, worker_id: int):
+        while True:
+            job = await self._queue.get()
+            self._waiting.remove(job)
+
+            # Остальным ожидающим сдвигаем позицию в фоне, чтобы не задерживать генерацию
+            refresh = asyncio.create_task(self._refresh_positions())
+            self._refreshes.add(refresh)
+            refresh.add_done_callback(self._refreshes.discard)
+
+            try:
+                await self._process(job)
+            except Exception as e:
+                logging.error(f"Image worker {worker_id} error: {e}")
+            finally:
+                self._per_user[job.user_id] -= 1
+                if not self._per_user[job.user_id]:
+                    del self._per_user[job.user_id]
+                self._queue.task_done()
+
+    async def _process(self, job: ImageJob):
+        # Единственный слой повторов генерации: сам запрос к сервису делает одну попытку
+        with deadline_scope(self.deadline) as deadline:
+            for attempt in range(1, self.max_attempts + 1):
+                if attempt == 1:
+                    await self._set_status(job, "🎨 Рисую (Flux)...")
+                else:
+                    await self._set_status(job, f"🎨 Рисую (Flux)... попытка {attempt} из {self.max_attempts}")
+
+                img_data = await self._render_progressive(job, attempt)
+                if img_data:
+                    try:
+                        await self.deliver(job, img_data)
+                    except Exception as e:
+                        # Картинка есть, но до пользователя не дошла — перерисовывать ее незачем
+                        logging.error(f"Image delivery error: {e}")
+                        break
+                    self._mark_first_image(job)
+                    await self._charge(job)
+                    return
+
+                # Экспоненциальная пауза: 2с, 4с, 8с... но только если бюджет задачи позволяет
+                delay = self.retry_delay * 2 ** (attempt - 1)
+                if attempt == self.max_attempts or delay >= deadline.remaining():
+                    break
+                await asyncio.sleep(delay)
+
+        if job.preview_message:
+            # Превью остается у пользователя — это тоже картинка, поэтому лимит списываем,
+            # иначе повторяющиеся сбои раздавали бы превью бесплатно
+            await self._set_status(job, "⚠️ Полную версию нарисовать не удалось, осталось только превью.")
+            await self._charge(job)
+            return
+        await self._set_status(job, "Ошибка генерации или сервис недоступен.")
+
+    async def _charge(self, job: ImageJob):
+        try:
+            await self.charge(job)
+        except Exception as e:
+            logging.error(f"Image usage charge error: {e}")
+
+    async def _render_progressive(self, job: ImageJob, attempt: int) -> Optional[bytes]:
+        """Рисует полную картинку, а пока она готовится — показывает превью (только в первой попытке)"""
+        final = asyncio.create_task(self.render(job.prompt, job.final, job.seed))
+        # На повторах сервис уже сбоит — не добавляем ему запросов превью
+        if job.preview is None or attempt > 1:
+            return await final
+
+        preview = asyncio.create_task(self.render(job.prompt, job.preview, job.seed))
+        try:
+            await asyncio.wait({final, preview}, return_when=asyncio.FIRST_COMPLETED)
+        except BaseException:
+            final.cancel()
+            preview.cancel()
+            raise
+
+        if not final.done():
+            preview_data = preview.result()
+            if preview_data:
+                async with job.status_lock:
+                    try:
+                        await self.show_preview(job, preview_data)
+                        self.previews_shown += 1
+                        self._mark_first_image(job)
+                    except Exception as e:
+                        logging.warning(f"Image preview error: {e}")
+        else:
+            # Полная картинка успела раньше — превью уже не нужно
+            preview.cancel()
+        return await final
+
+    def _mark_first_image(self, job: ImageJob):
+        if job.submitted_at is not None:
+            self._first_image_times.append(time.monotonic() - job.submitted_at)
+            job.submitted_at = None
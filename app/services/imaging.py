@@ -0,0 +1,139 @@
+import asyncio
+import io
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from PIL import Image
+
+from ..config import (
+    IMG_ENCODE_FORMAT, IMG_ENCODE_QUALITY, IMG_ENCODE_MIN_QUALITY, IMG_ENCODE_MAX_KB,
+    IMG_ENCODE_WORKERS, IMG_UPLOAD_KBPS, IMG_ORIGINALS_CACHE
+)
+
+_EXTENSIONS = {"JPEG": "jpg", "WEBP": "webp"}
+
+
+@dataclass
+class EncodedImage:
+    data: bytes
+    filename: str
+    original_size: int
+    encode_ms: float
+
+
+class ImageEncoder:
+    """
+    Перекодирует картинки от генератора (часто тяжелые PNG) в JPEG/WebP с потолком размера.
+    Кодирование — CPU-работа, поэтому идет в отдельном пуле потоков, а не в event loop.
+    """
+
+    def __init__(self, fmt: str, quality: int, min_quality: int, max_kb: int,
+                 workers: int, upload_kbps: int, originals_cache: int):
+        if fmt not in _EXTENSIONS:
+            raise ValueError(f"Неподдерживаемый формат картинок: {fmt}")
+        self.fmt = fmt
+        self.quality = quality
+        self.min_quality = min_quality
+        self.max_bytes = max_kb * 1024
+        self.upload_kbps = upload_kbps
+        self.originals_cache = originals_cache
+
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="img-encode")
+        # Оригиналы для кнопки "файлом": id -> (байты, имя файла), старые вытесняются
+        self._originals: OrderedDict[str, tuple[bytes, str]] = OrderedDict()
+
+        self.images = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.encode_ms = 0.0
+
+    def stats(self) -> dict:
+        saved = self.bytes_in - self.bytes_out
+        # Сколько времени не ушло на загрузку в Telegram (оценка по IMG_UPLOAD_KBPS) за вычетом кодирования
+        upload_ms_saved = saved * 8 / self.upload_kbps if self.upload_kbps else 0.0
+        return {
+            "images": self.images,
+            "bytes_saved": saved,
+            "saved_pct": 100 * saved / self.bytes_in if self.bytes_in else 0.0,
+            "encode_ms_avg": self.encode_ms / self.images if self.images else 0.0,
+            "ms_saved": upload_ms_saved - self.encode_ms,
+        }
+
+    async def encode(self, data: bytes, name: str = "image") -> EncodedImage:
+        """Сжимает картинку для отправки фото; при ошибке или без выигрыша возвращает исходные байты"""
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            encoded, ext = await loop.run_in_executor(self._executor, self._encode_sync, data)
+        except Exception as e:
+            logging.warning(f"Image encode error: {e}")
+            encoded, ext = None, None
+        encode_ms = (time.perf_counter() - started) * 1000
+
+        if encoded is None or len(encoded) >= len(data):
+            encoded, ext = data, _guess_extension(data)
+
+        self.images += 1
+        self.bytes_in += len(data)
+        self.bytes_out += len(encoded)
+        self.encode_ms += encode_ms
+        return EncodedImage(encoded, f"{name}.{ext}", len(data), encode_ms)
+
+    def _encode_sync(self, data: bytes) -> tuple[bytes, str]:
+        with Image.open(io.BytesIO(data)) as image:
+            image.load()
+            # JPEG не умеет прозрачность, WebP умеет, но генератор ее все равно не использует
+            if image.mode != "RGB":
+                image = image.convert("RGB")
+
+            quality = self.quality
+            while True:
+                buffer = io.BytesIO()
+                image.save(buffer, self.fmt, quality=quality, optimize=True)
+                encoded = buffer.getvalue()
+                if not self.max_bytes or len(encoded) <= self.max_bytes:
+                    break
+                if quality > self.min_quality:
+                    quality = max(self.min_quality, quality - 10)
+                    continue
+                # Качество уже на минимуме — уменьшаем разрешение
+                if min(image.size) <= 256:
+                    break
+                image = image.resize((image.width * 3 // 4, image.height * 3 // 4), Image.LANCZOS)
+        return encoded, _EXTENSIONS[self.fmt]
+
+    # --- ОРИГИНАЛЫ ДЛЯ ОТПРАВКИ ФАЙЛОМ ---
+
+    def keep_original(self, data: bytes, name: str = "image") -> str:
+        """Запоминает оригинал и возвращает короткий id для callback-кнопки"""
+        key = uuid.uuid4().hex[:16]
+        self._originals[key] = (data, f"{name}.{_guess_extension(data)}")
+        while len(self._originals) > self.originals_cache:
+            self._originals.popitem(last=False)
+        return key
+
+    def original(self, key: str) -> tuple[bytes, str] | None:
+        return self._originals.get(key)
+
+
+def _guess_extension(data: bytes) -> str:
+    if data.startswith(b"\x89PNG"):
+        return "png"
+    if data[8:12] == b"WEBP":
+        return "webp"
+    return "jpg"
+
+
+image_encoder = ImageEncoder(
+    fmt=IMG_ENCODE_FORMAT,
+    quality=IMG_ENCODE_QUALITY,
+    min_quality=IMG_ENCODE_MIN_QUALITY,
+    max_kb=IMG_ENCODE_MAX_KB,
+    workers=IMG_ENCODE_WORKERS,
+    upload_kbps=IMG_UPLOAD_KBPS,
+    originals_cache=IMG_ORIGINALS_CACHE
+)
@@ -0,0 +1,192 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod, SendChatAction
+
+from ..config import (
+    SEND_GLOBAL_RATE_PER_PROCESS, SEND_CHAT_RATE, SEND_CHAT_BURST, SEND_GROUP_RATE, SEND_MAX_RETRIES
+)
+
+# Приоритет исходящих запросов текущего кода: ответы пользователям идут раньше рассылок
+_bulk: ContextVar[bool] = ContextVar("bulk_send", default=False)
+
+@contextmanager
+def bulk_sends():
+    """Все отправки внутри блока — фоновые (рассылки, напоминания, служебные правки)"""
+    token = _bulk.set(True)
+    try:
+        yield
+    finally:
+        _bulk.reset(token)
+
+
+class _TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self) -> float:
+        """Через сколько секунд будет доступен токен (0 — уже есть)"""
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def is_full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.burst
+
+
+class _GlobalLimiter:
+    """Общий лимит бота с двумя очередями: интерактив обслуживается раньше рассылок"""
+
+    def __init__(self, rate: float):
+        self.bucket = _TokenBucket(rate, burst=rate)
+        self.interactive: deque[asyncio.Future] = deque()
+        self.bulk: deque[asyncio.Future] = deque()
+        self._pump: asyncio.Task = None
+
+    async def acquire(self, bulk: bool):
+        future = asyncio.get_running_loop().create_future()
+        (self.bulk if bulk else self.interactive).append(future)
+        if self._pump is None or self._pump.done():
+            self._pump = asyncio.create_task(self._run())
+        await future
+
+    async def _run(self):
+        while self.interactive or self.bulk:
+            delay = self.bucket.wait_time()
+            if delay:
+                await asyncio.sleep(delay)
+                continue
+            queue = self.interactive or self.bulk
+            future = queue.popleft()
+            if future.done():
+                # Ожидающий отменился (например, по дедлайну) — токен не тратим
+                continue
+            self.bucket.take()
+            future.set_result(None)
+
+
+class _ChatState:
+    def __init__(self, rate: float, burst: float):
+        # Замок держится на время всего запроса: сообщения в чат уходят строго по порядку
+        self.lock = asyncio.Lock()
+        self.bucket = _TokenBucket(rate, burst)
+        self.users = 0
+
+
+class OutboundScheduler(BaseRequestMiddleware):
+    """
+    Единая точка для всех исходящих запросов бота (middleware сессии Bot).
+    Соблюдает общий лимит и лимит на чат, сохраняет порядок внутри чата,
+    сам переживает 429 (RetryAfter) и пропускает ответы пользователям вперед рассылок.
+    """
+
+    def __init__(self, global_rate: float, chat_rate: float, chat_burst: int,
+                 group_rate: float, max_retries: int):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+
+        self._global = _GlobalLimiter(global_rate)
+        self._chats: dict[int | str, _ChatState] = {}
+        self._created = 0
+
+        self.sent = 0
+        self.retry_after_count = 0
+
+    def stats(self) -> dict:
+        return {
+            "interactive_queue": len(self._global.interactive),
+            "bulk_queue": len(self._global.bulk),
+            "busy_chats": sum(1 for state in self._chats.values() if state.users),
+            "sent": self.sent,
+            "retry_after": self.retry_after_count,
+        }
+
+    def _chat(self, chat_id) -> _ChatState:
+        state = self._chats.get(chat_id)
+        if state is None:
+            self._created += 1
+            if self._created % 1000 == 0:
+                self._sweep()
+            # Группы и каналы (отрицательный ID или @username) лимитируются строже личных чатов
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            if is_group:
+                state = _ChatState(self.group_rate, 1)
+            else:
+                state = _ChatState(self.chat_rate, self.chat_burst)
+            self._chats[chat_id] = state
+        return state
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod):
+        chat_id = getattr(method, "chat_id", None)
+        # Запросы без чата (getUpdates, answerCallbackQuery) и "печатает..." не лимитируем
+        if chat_id is None or isinstance(method, SendChatAction):
+            return await make_request(bot, method)
+
+        bulk = _bulk.get()
+        state = self._chat(chat_id)
+        state.users += 1
+        try:
+            async with state.lock:
+                return await self._send(make_request, bot, method, state, bulk)
+        finally:
+            state.users -= 1
+
+    def _sweep(self):
+        """Забываем чаты, где никто не ждет и лимит полностью восстановился"""
+        for chat_id, state in list(self._chats.items()):
+            if not state.users and state.bucket.is_full():
+                del self._chats[chat_id]
+
+    async def _send(self, make_request, bot, method, state: _ChatState, bulk: bool):
+        attempt = 0
+        while True:
+            delay = state.bucket.wait_time()
+            if delay:
+                await asyncio.sleep(delay)
+            await self._global.acquire(bulk)
+            state.bucket.take()
+
+            try:
+                response = await make_request(bot, method)
+                self.sent += 1
+                return response
+            except TelegramRetryAfter as e:
+                self.retry_after_count += 1
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                logging.warning(
+                    f"Telegram 429 ({type(method).__name__}, chat {method.chat_id}): "
+                    f"ждем {e.retry_after} с, повтор {attempt}/{self.max_retries}"
+                )
+                # Держим замок чата, пока ждем: следующие сообщения не обгонят это
+                await asyncio.sleep(e.retry_after)
+
+
+send_scheduler = OutboundScheduler(
+    global_rate=SEND_GLOBAL_RATE_PER_PROCESS,
+    chat_rate=SEND_CHAT_RATE,
+    chat_burst=SEND_CHAT_BURST,
+    group_rate=SEND_GROUP_RATE,
+    max_retries=SEND_MAX_RETRIES
+)
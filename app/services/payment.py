@@ -1,22 +1,46 @@
 import uuid
 import os
+import asyncio
 import logging
+import requests
 from yookassa import Configuration, Payment
+from yookassa.domain.exceptions import ApiError, ResponseProcessingError, TooManyRequestsError
+
+from .deadline import (
+    call_with_retries, ExternalCallError, UpstreamTimeout, RateLimited, UpstreamUnavailable
+)
 
 # Настраиваем ЮKassa
 # Ключи берутся из .env, который мы настроили ранее
 Configuration.account_id = os.getenv("YOOKASSA_SHOP_ID")
 Configuration.secret_key = os.getenv("YOOKASSA_SECRET_KEY")
 
-def create_payment(amount: float, description: str, user_id: int, tariff_id: int, duration: int):
+def _classify_yookassa_error(e: Exception):
+    """Переводит ошибки SDK ЮKassa и requests в наши типы"""
+    if isinstance(e, TooManyRequestsError):
+        return RateLimited(str(e))
+    if isinstance(e, ResponseProcessingError) or type(e) is ApiError:
+        # 202 "еще обрабатывается" и 5xx (SDK отдает их голым ApiError)
+        return UpstreamUnavailable(str(e))
+    if isinstance(e, requests.Timeout):
+        return UpstreamTimeout(str(e))
+    if isinstance(e, requests.ConnectionError):
+        return UpstreamUnavailable(str(e))
+    if isinstance(e, ApiError):
+        return ExternalCallError(str(e))
+    return None
+
+async def create_payment(amount: float, description: str, user_id: int, tariff_id: int, duration: int):
     """
     Создает платеж в ЮKassa.
     Возвращает: (payment_url, payment_id)
     """
     try:
+        # Один ключ на все повторы: ЮKassa не создаст второй платеж
         idempotence_key = str(uuid.uuid4())
         
-        payment = Payment.create({
+        # SDK синхронный (requests), поэтому уводим его в поток, чтобы не блокировать event loop
+        payment = await call_with_retries(lambda: asyncio.to_thread(Payment.create, {
             "amount": {
                 "value": str(amount),
                 "currency": "RUB"
@@ -32,10 +56,10 @@ def create_payment(amount: float, description: str, user_id: int, tariff_id: int
                 "tariff_id": tariff_id, # Важно: сохраняем ID тарифа
                 "duration": duration
             }
-        }, idempotence_key)
+        }, idempotence_key), "YooKassa", _classify_yookassa_error)
 
         return payment.confirmation.confirmation_url, payment.id
         
     except Exception as e:
-        logging.error(f"Ошибка создания платежа ЮKassa: {e}")
+        logging.error(f"Ошибка создания платежа ЮKassa [{getattr(e, 'kind', 'unknown')}]: {e}")
         return None, None
\ No newline at end of file
@@ -0,0 +1,181 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError, TelegramBadRequest
+
+from .outbound import bulk_sends
+from .sharding import on_control, broadcast_control
+from ..database.orm import (
+    get_premium_to_remind, claim_premium_reminder, release_premium_reminder, get_last_reminded_until
+)
+from ..config import (
+    PREMIUM_CACHE_TTL, PREMIUM_CACHE_MAX_SIZE,
+    PREMIUM_REMIND_DAYS, PREMIUM_EXPIRED_WINDOW_HOURS, PREMIUM_REMIND_INTERVAL, PREMIUM_REMIND_BATCH
+)
+
+# Виды напоминаний
+EXPIRING = "expiring"  # Подписка скоро закончится
+EXPIRED = "expired"    # Подписка только что закончилась
+
+# Служебное сообщение воркерам: сбросить подписку пользователя в кэше
+PREMIUM_INVALIDATE = "premium_invalidate"
+
+
+def premium_active(user) -> bool:
+    return bool(user.premium_until and user.premium_until > datetime.utcnow())
+
+
+class PremiumCache:
+    """
+    Кэш статуса подписки: telegram_id -> дата окончания. Хранятся только активные подписки.
+    Флаг считается от самой даты, поэтому гаснет ровно в момент окончания, без таймеров и опроса базы.
+    Вместе с датой хранится профиль (username, имя) из базы: если он сменился, идем в базу, и она его обновит.
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: OrderedDict[int, tuple[datetime, float, tuple]] = OrderedDict()
+
+    def is_premium(self, tg_id: int, profile: tuple = None) -> bool:
+        """True — подписка точно активна; False — неизвестно (или профиль изменился), нужно смотреть в базу"""
+        entry = self._entries.get(tg_id)
+        if entry is None:
+            return False
+        premium_until, cached_at, cached_profile = entry
+        if premium_until <= datetime.utcnow() or time.monotonic() - cached_at > self.ttl:
+            del self._entries[tg_id]
+            return False
+        return profile is None or profile == cached_profile
+
+    def remember(self, user):
+        if not premium_active(user):
+            self._entries.pop(user.telegram_id, None)
+            return
+        profile = (user.username, user.full_name)
+        self._entries[user.telegram_id] = (user.premium_until, time.monotonic(), profile)
+        self._entries.move_to_end(user.telegram_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, tg_id: int):
+        """Только этот процесс; при выдаче и отзыве подписки — invalidate_premium"""
+        self._entries.pop(tg_id, None)
+
+
+def invalidate_premium(tg_id: int):
+    """Сброс статуса подписки в кэше этого процесса и всех воркеров (выдача, отзыв, оплата)"""
+    premium_cache.invalidate(tg_id)
+    broadcast_control(PREMIUM_INVALIDATE, tg_id=tg_id)
+
+
+class PremiumReminderScheduler:
+    """
+    Фоновая проверка подписок: напоминает о скором окончании и сообщает об истечении.
+    Читает базу по индексу premium_until ограниченными пачками, шлет как фоновые
+    отправки (после ответов пользователям) и записывает каждое напоминание, чтобы не повторять.
+    """
+
+    def __init__(self, remind_before: timedelta, expired_window: timedelta, interval: float, batch_size: int):
+        self.remind_before = remind_before
+        self.expired_window = expired_window
+        self.interval = interval
+        self.batch_size = batch_size
+        self._task: asyncio.Task = None
+
+    def start(self, bot: Bot):
+        """Запускает проверку (вызывать при старте приложения, в одном процессе)"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(bot))
+
+    async def _run(self, bot: Bot):
+        while True:
+            try:
+                sent = await self.run_once(bot)
+                if sent:
+                    logging.info(f"Напоминания о подписке: отправлено {sent}")
+            except Exception as e:
+                logging.error(f"Premium reminders error: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self, bot: Bot) -> int:
+        now = datetime.utcnow()
+        sent = await self._remind(bot, EXPIRING, now, now + self.remind_before)
+        sent += await self._remind(bot, EXPIRED, await self._expired_since(now), now)
+        return sent
+
+    async def _expired_since(self, now: datetime) -> datetime:
+        """
+        Нижняя граница поиска истекших подписок. Окно отсчитываем не только от "сейчас", но и от последней
+        подписки, о которой уже сообщили: после простоя бота дольше окна пропущенные уведомления все равно уйдут.
+        Повторов не будет — каждое напоминание записано (claim). Без истории (первый запуск) — только окно,
+        чтобы не разослать уведомления о давно закончившихся подписках.
+        """
+        since = now - self.expired_window
+        last = await get_last_reminded_until(EXPIRED)
+        if last is not None:
+            since = min(since, last - self.expired_window)
+        return since
+
+    async def _remind(self, bot: Bot, kind: str, start: datetime, end: datetime) -> int:
+        sent = 0
+        after = None
+        while True:
+            batch = await get_premium_to_remind(kind, start, end, after, self.batch_size)
+            if not batch:
+                return sent
+            after = (batch[-1].premium_until, batch[-1].id)
+
+            # Лимиты Telegram соблюдает планировщик отправки, ответы пользователям идут вперед
+            with bulk_sends():
+                results = await asyncio.gather(*(self._send(bot, kind, row) for row in batch))
+            sent += sum(results)
+
+            if len(batch) < self.batch_size:
+                return sent
+
+    async def _send(self, bot: Bot, kind: str, row) -> bool:
+        # Сначала записываем, потом шлем: лучше потерять одно напоминание, чем прислать его дважды
+        if not await claim_premium_reminder(row.telegram_id, kind, row.premium_until):
+            return False
+
+        date_str = row.premium_until.strftime("%d.%m.%Y")
+        if kind == EXPIRING:
+            text = f"⏳ Ваша Premium подписка закончится `{date_str}`.\nПродлить заранее: /buy"
+        else:
+            text = "⌛️ Ваша Premium подписка закончилась, действуют бесплатные лимиты.\nПродлить: /buy"
+
+        try:
+            await bot.send_message(row.telegram_id, text)
+            return True
+        except (TelegramForbiddenError, TelegramBadRequest):
+            # Бот заблокирован или чата больше нет — повторять бессмысленно, запись оставляем
+            return False
+        except Exception as e:
+            # Временный сбой: снимаем запись, следующая проверка отправит напоминание еще раз
+            logging.warning(f"Premium reminder to {row.telegram_id} failed: {e}")
+            try:
+                await release_premium_reminder(row.telegram_id, kind, row.premium_until)
+            except Exception as release_error:
+                logging.error(f"Premium reminder release error: {release_error}")
+            return False
+
+
+premium_cache = PremiumCache(ttl=PREMIUM_CACHE_TTL, max_size=PREMIUM_CACHE_MAX_SIZE)
+
+
+@on_control(PREMIUM_INVALIDATE)
+def _apply_invalidate(message: dict):
+    premium_cache.invalidate(message["tg_id"])
+
+
+premium_reminders = PremiumReminderScheduler(
+    remind_before=timedelta(days=PREMIUM_REMIND_DAYS),
+    expired_window=timedelta(hours=PREMIUM_EXPIRED_WINDOW_HOURS),
+    interval=PREMIUM_REMIND_INTERVAL,
+    batch_size=PREMIUM_REMIND_BATCH
+)
@@ -0,0 +1,204 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+
+# Все замеры живут только внутри сессии профилирования: вне ее нет ни потока, ни хуков
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _is_project_file(path: str) -> bool:
+    return path.startswith(_PROJECT_ROOT) and "site-packages" not in path
+
+
+# Кадры самого профилировщика (обертка Handle._run) есть в каждом стеке сессии — это не работа бота
+_OWN_FILE = _is_project_file.__code__.co_filename
+
+
+def _frame_label(code) -> str:
+    path = code.co_filename
+    if _is_project_file(path):
+        path = os.path.relpath(path, _PROJECT_ROOT)
+    else:
+        path = os.path.basename(path)
+    # ";" — разделитель кадров в формате collapsed stacks
+    return f"{code.co_name} ({path})".replace(";", ":")
+
+
+@dataclass
+class ProfileReport:
+    seconds: float
+    samples: int = 0
+    idle_samples: int = 0
+    stacks: Counter = field(default_factory=Counter)
+    # Самая "глубокая" функция проекта в сэмпле — где реально тратится время нашего кода
+    hot_functions: Counter = field(default_factory=Counter)
+    loop_lags: list[float] = field(default_factory=list)
+    handler_times: dict[str, list[float]] = field(default_factory=lambda: defaultdict(list))
+    slow_callbacks: list[tuple[str, float]] = field(default_factory=list)
+
+    def folded(self) -> bytes:
+        """Профиль в формате collapsed stacks (flamegraph.pl, speedscope, inferno)"""
+        lines = [f"{stack} {count}" for stack, count in self.stacks.most_common()]
+        return "\n".join(lines).encode()
+
+    def summary(self, top_n: int) -> str:
+        busy = self.samples - self.idle_samples
+        idle_pct = 100 * self.idle_samples / self.samples if self.samples else 0
+        lines = [f"📊 Профиль за {self.seconds:.0f} с: {self.samples} сэмплов, простой {idle_pct:.0f}%"]
+
+        if self.loop_lags:
+            lags = sorted(self.loop_lags)
+            p99 = lags[min(len(lags) - 1, int(len(lags) * 0.99))]
+            avg = sum(lags) / len(lags)
+            lines.append(f"⏱ Лаг event loop: avg {avg * 1000:.1f} мс, p99 {p99 * 1000:.1f} мс, max {lags[-1] * 1000:.1f} мс")
+
+        if self.handler_times:
+            lines.append("\n🐢 Медленные хендлеры (по max):")
+            ranked = sorted(self.handler_times.items(), key=lambda item: max(item[1]), reverse=True)
+            for name, times in ranked[:top_n]:
+                avg = sum(times) / len(times)
+                lines.append(f"• {name}: {len(times)} раз, avg {avg * 1000:.0f} мс, max {max(times) * 1000:.0f} мс")
+
+        if self.slow_callbacks:
+            lines.append("\n🐌 Медленные корутины (блокировали loop):")
+            by_coro = defaultdict(list)
+            for name, duration in self.slow_callbacks:
+                by_coro[name].append(duration)
+            ranked = sorted(by_coro.items(), key=lambda item: sum(item[1]), reverse=True)
+            for name, durations in ranked[:top_n]:
+                lines.append(f"• {name}: {len(durations)} раз, всего {sum(durations) * 1000:.0f} мс, max {max(durations) * 1000:.0f} мс")
+
+        if busy:
+            lines.append("\n🔥 Горячие функции (доля занятого времени):")
+            for name, count in self.hot_functions.most_common(top_n):
+                lines.append(f"• {name}: {100 * count / busy:.1f}%")
+
+        return "\n".join(lines)
+
+
+def _callback_name(handle: asyncio.Handle) -> str:
+    callback = handle._callback
+    # Шаг корутины: callback — метод задачи (TaskStepMethWrapper / task_wakeup), имя берем у корутины
+    task = getattr(callback, "__self__", None)
+    if isinstance(task, asyncio.Task):
+        coro = task.get_coro()
+        return getattr(coro, "__qualname__", None) or repr(coro)[:80]
+    return getattr(callback, "__qualname__", None) or repr(callback)[:80]
+
+
+class _CallbackTimer:
+    """
+    Замер каждого callback'а event loop'а на время сессии: подменяет Handle._run.
+    Debug-режим asyncio для этого не нужен — он замедляет весь loop и искажает сами замеры.
+    """
+
+    def __init__(self, report: ProfileReport, threshold: float):
+        self.report = report
+        self.threshold = threshold
+        self._original = None
+
+    def install(self):
+        original = self._original = asyncio.events.Handle._run
+        report, threshold = self.report, self.threshold
+
+        def timed_run(handle):
+            started = time.perf_counter()
+            try:
+                return original(handle)
+            finally:
+                duration = time.perf_counter() - started
+                if duration >= threshold:
+                    report.slow_callbacks.append((_callback_name(handle), duration))
+
+        asyncio.events.Handle._run = timed_run
+
+    def uninstall(self):
+        asyncio.events.Handle._run = self._original
+
+
+class LoopProfiler:
+    """
+    Семплирующий профилировщик event loop'а по требованию:
+    стек главного потока, лаг loop'а, медленные callback'и и время хендлеров.
+    """
+
+    def __init__(self, sample_interval: float, slow_callback: float, lag_interval: float = 0.05):
+        self.sample_interval = sample_interval
+        self.slow_callback = slow_callback
+        self.lag_interval = lag_interval
+        self.report: ProfileReport = None
+
+    @property
+    def running(self) -> bool:
+        return self.report is not None
+
+    def record_handler(self, name: str, duration: float):
+        if self.report is not None:
+            self.report.handler_times[name].append(duration)
+
+    async def run(self, seconds: float) -> ProfileReport:
+        if self.running:
+            raise RuntimeError("Профилирование уже запущено")
+
+        loop = asyncio.get_running_loop()
+        report = ProfileReport(seconds=seconds)
+        self.report = report
+
+        stop = threading.Event()
+        sampler = threading.Thread(
+            target=self._sample, args=(threading.get_ident(), report, stop),
+            name="loop-profiler", daemon=True
+        )
+        lag_task = asyncio.create_task(self._watch_lag(loop, report))
+
+        timer = _CallbackTimer(report, self.slow_callback)
+        timer.install()
+
+        sampler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            stop.set()
+            lag_task.cancel()
+            timer.uninstall()
+            await asyncio.to_thread(sampler.join)
+            self.report = None
+
+        return report
+
+    def _sample(self, thread_id: int, report: ProfileReport, stop: threading.Event):
+        while not stop.wait(self.sample_interval):
+            frame = sys._current_frames().get(thread_id)
+            if frame is None:
+                continue
+
+            report.samples += 1
+            # Loop ждет событий в select — это простой, а не работа
+            if frame.f_code.co_filename.endswith("selectors.py"):
+                report.idle_samples += 1
+                continue
+
+            labels = []
+            hot = None
+            while frame is not None:
+                path = frame.f_code.co_filename
+                if path != _OWN_FILE:
+                    labels.append(_frame_label(frame.f_code))
+                    if hot is None and _is_project_file(path):
+                        hot = labels[-1]
+                frame = frame.f_back
+            if not labels:
+                continue
+
+            report.stacks[";".join(reversed(labels))] += 1
+            report.hot_functions[hot or labels[0]] += 1
+
+    async def _watch_lag(self, loop: asyncio.AbstractEventLoop, report: ProfileReport):
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.lag_interval)
+            report.loop_lags.append(max(0.0, loop.time() - start - self.lag_interval))
@@ -0,0 +1,134 @@
+import asyncio
+import logging
+from multiprocessing.queues import Queue
+from typing import Callable
+
+from aiogram import Bot, Dispatcher
+
+# Типы апдейтов, в которых чат лежит в message.chat
+_MESSAGE_KEYS = ("message", "edited_message", "channel_post", "edited_channel_post", "business_message")
+
+
+def update_chat_id(update: dict) -> int:
+    """ID чата, к которому относится апдейт (или пользователя, если чата нет)"""
+    for key in _MESSAGE_KEYS:
+        if key in update:
+            return update[key]["chat"]["id"]
+
+    callback = update.get("callback_query")
+    if callback:
+        message = callback.get("message")
+        if message:
+            return message["chat"]["id"]
+        return callback["from"]["id"]
+
+    for event in update.values():
+        # Остальные типы (inline_query, pre_checkout_query, my_chat_member...) — по чату или автору
+        if isinstance(event, dict):
+            if "chat" in event:
+                return event["chat"]["id"]
+            if "from" in event:
+                return event["from"]["id"]
+    return 0
+
+
+class ShardRouter:
+    """
+    Раскладывает апдейты по процессам-воркерам по хэшу чата.
+    Все апдейты одного чата попадают в один воркер и в том же порядке,
+    поэтому FSM, склейка сообщений и порядок ответов остаются внутри процесса.
+    """
+
+    def __init__(self, queues: list[Queue]):
+        self.queues = queues
+
+    def route(self, update: dict):
+        shard = update_chat_id(update) % len(self.queues)
+        self.queues[shard].put(update)
+
+    def broadcast(self, message: dict):
+        for queue in self.queues:
+            queue.put(message)
+
+
+# --- СЛУЖЕБНЫЕ СООБЩЕНИЯ ВОРКЕРАМ ---
+# Кэши и счетчики у каждого процесса свои. Изменения, которые должны дойти до всех
+# (например, отзыв подписки), рассылаются по тем же очередям, что и апдейты.
+# У апдейтов Telegram ключей с "_" не бывает, так что спутать их нельзя.
+CONTROL_KEY = "_control"
+
+_control_handlers: dict[str, Callable[[dict], None]] = {}
+# Маршрутизатор и номер воркера текущего процесса (None — бот работает одним процессом)
+_router: ShardRouter = None
+worker_index: int = None
+
+
+def use_router(router: ShardRouter, index: int = None):
+    """Вызывают фронт (без номера) и каждый воркер при старте"""
+    global _router, worker_index
+    _router = router
+    worker_index = index
+
+
+def on_control(kind: str):
+    """Регистрирует обработчик служебного сообщения вида kind (выполняется в каждом воркере)"""
+    def register(handler: Callable[[dict], None]):
+        _control_handlers[kind] = handler
+        return handler
+    return register
+
+
+def broadcast_control(kind: str, **payload):
+    """Отправляет служебное сообщение всем воркерам; в одном процессе ничего не делает"""
+    if _router is not None:
+        _router.broadcast({CONTROL_KEY: kind, **payload})
+
+
+def handle_control(message: dict):
+    handler = _control_handlers.get(message[CONTROL_KEY])
+    if handler is None:
+        logging.warning(f"Неизвестное служебное сообщение: {message[CONTROL_KEY]}")
+        return
+    try:
+        handler(message)
+    except Exception as e:
+        logging.error(f"Служебное сообщение {message[CONTROL_KEY]}: {e}")
+
+
+async def poll_updates(bot: Bot, router: ShardRouter, allowed_updates: list[str]):
+    """Фронт в режиме polling: сам забирает getUpdates и раздает воркерам"""
+    await bot.delete_webhook(drop_pending_updates=True)
+    offset = None
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=30, allowed_updates=allowed_updates)
+        except Exception as e:
+            logging.error(f"getUpdates error: {e}")
+            await asyncio.sleep(1)
+            continue
+
+        for update in updates:
+            router.route(update.model_dump(mode="json", exclude_none=True, by_alias=True))
+            offset = update.update_id + 1
+
+
+async def consume_updates(queue: Queue, dp: Dispatcher, bot: Bot):
+    """Воркер: читает апдейты из своей очереди и отдает их Dispatcher'у (None — сигнал остановки)"""
+    loop = asyncio.get_running_loop()
+    tasks: set[asyncio.Task] = set()
+    while True:
+        # multiprocessing.Queue блокирующая, ждем ее в потоке, чтобы не стопорить event loop
+        update = await loop.run_in_executor(None, queue.get)
+        if update is None:
+            break
+        if CONTROL_KEY in update:
+            handle_control(update)
+            continue
+
+        # Как и при polling, апдейты обрабатываются параллельно, но запускаются в порядке прихода
+        task = asyncio.create_task(dp.feed_raw_update(bot, update))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    if tasks:
+        await asyncio.gather(*tasks, return_exceptions=True)
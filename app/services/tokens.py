@@ -0,0 +1,40 @@
+import math
+import re
+
+# Грубая, но локальная (без сети и токенизатора) оценка числа токенов.
+# BPE-токенизаторы режут английские слова примерно по 4 символа,
+# а кириллицу и прочий не-ASCII текст — заметно мельче, примерно по 2 символа.
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+TRUNCATED_MARK = "\n…[текст обрезан]"
+
+
+def estimate_tokens(text: str) -> int:
+    """Оценивает размер текста в токенах"""
+    if not text:
+        return 0
+
+    tokens = 0
+    for match in _TOKEN_RE.finditer(text):
+        word = match.group()
+        if word.isascii():
+            tokens += math.ceil(len(word) / 4)
+        else:
+            tokens += math.ceil(len(word) / 2)
+    return tokens
+
+
+def truncate_to_tokens(text: str, limit: int) -> str:
+    """Обрезает текст с конца так, чтобы он влез в `limit` токенов"""
+    if estimate_tokens(text) <= limit:
+        return text
+
+    budget = limit - estimate_tokens(TRUNCATED_MARK)
+    if budget <= 0:
+        # Лимит меньше самой пометки — от текста ничего не остается
+        return TRUNCATED_MARK.lstrip()
+    # Первое приближение — пропорция по символам, дальше ужимаем шагами по 10%
+    cut = int(len(text) * budget / estimate_tokens(text))
+    while cut > 0 and estimate_tokens(text[:cut]) > budget:
+        cut = int(cut * 0.9)
+    return text[:cut] + TRUNCATED_MARK
@@ -0,0 +1,374 @@
+"""
+Микробенчмарк функций app/database/orm.py на синтетических базах разного размера.
+
+Запуск (из корня проекта):
+    python -m benchmarks.orm_bench --users 10000 100000 1000000 --out bench.json
+    python -m benchmarks.orm_bench --users 100000 --compare bench.json
+
+Для каждого размера базы:
+  * латентность одиночного вызова (p50/p95/p99) для точечных функций;
+  * пропускная способность при N параллельных корутинах;
+  * время и пик памяти (tracemalloc) для функций, читающих всю таблицу;
+  * EXPLAIN QUERY PLAN всех SQL-запросов функции — "SCAN users" означает полный проход без индекса.
+
+Результаты пишутся в JSON с постоянными ключами, чтобы прогоны можно было сравнивать (--compare).
+Сгенерированные базы кэшируются в benchmarks/data/ (пересоздать: --rebuild). Замеры пишут в базу,
+поэтому каждый прогон идет на ее временной копии, а кэш остается нетронутым.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, event
+
+from app.database import orm
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+FIRST_TG_ID = 100_000_000
+PREMIUM_SHARE = 0.1
+
+# Точечные функции: (имя, фабрика вызова от случайного существующего telegram_id)
+POINT_OPS = {
+    "get_user": lambda tg_id: orm.get_user(tg_id),
+    "increment_usage": lambda tg_id: orm.increment_usage(tg_id, "text"),
+    "add_premium_time": lambda tg_id: orm.add_premium_time(tg_id, 1),
+}
+# Функции по всей таблице
+FULL_TABLE_OPS = {
+    "get_stats": lambda: orm.get_stats(),
+    "get_all_users_ids": lambda: orm.get_all_users_ids(),
+}
+
+
+# --- ГЕНЕРАЦИЯ БАЗЫ ---
+
+def build_database(path: str, users: int, seed: int):
+    """Создает схему через модели ORM и заливает `users` синтетических пользователей"""
+    if os.path.exists(path):
+        os.remove(path)
+
+    sync_engine = create_engine(f"sqlite:///{path}")
+    orm.Base.metadata.create_all(sync_engine)
+    sync_engine.dispose()
+
+    rnd = random.Random(seed)
+    now = datetime.utcnow()
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+
+    batch = []
+    for i in range(users):
+        premium_until = None
+        if rnd.random() < PREMIUM_SHARE:
+            # Половина подписок уже истекла, половина активна
+            premium_until = _sql_datetime(now + timedelta(days=rnd.uniform(-60, 60)))
+        batch.append((
+            FIRST_TG_ID + i,
+            f"user{i}",
+            f"Bench User {i}",
+            rnd.randint(0, 100),
+            rnd.randint(0, 5),
+            premium_until,
+            _sql_datetime(now - timedelta(days=rnd.uniform(0, 365))),
+        ))
+        if len(batch) == 50_000:
+            _insert_users(conn, batch)
+            batch.clear()
+    if batch:
+        _insert_users(conn, batch)
+
+    conn.commit()
+    conn.close()
+
+
+def _sql_datetime(value: datetime) -> str:
+    # Тот же формат, в котором SQLAlchemy хранит DateTime в SQLite
+    return value.strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+def _insert_users(conn: sqlite3.Connection, rows: list):
+    conn.executemany(
+        "INSERT INTO users (telegram_id, username, full_name, text_usage, image_usage, premium_until, joined_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        rows
+    )
+
+
+def database_for(users: int, seed: int, rebuild: bool) -> str:
+    os.makedirs(DATA_DIR, exist_ok=True)
+    path = os.path.join(DATA_DIR, f"users_{users}_seed{seed}.db")
+    if rebuild or not os.path.exists(path):
+        started = time.perf_counter()
+        build_database(path, users, seed)
+        print(f"  база {users} пользователей создана за {time.perf_counter() - started:.1f} с", file=sys.stderr)
+    return path
+
+
+def working_copy(path: str) -> str:
+    """Копия кэшированной базы для одного прогона: записи замеров не должны попадать в следующий"""
+    fd, copy_path = tempfile.mkstemp(prefix="orm_bench_", suffix=".db")
+    os.close(fd)
+    # backup, а не копирование файла: подхватывает и то, что еще лежит в WAL
+    src, dst = sqlite3.connect(path), sqlite3.connect(copy_path)
+    try:
+        src.backup(dst)
+    finally:
+        src.close()
+        dst.close()
+    return copy_path
+
+
+def remove_database(path: str):
+    for suffix in ("", "-wal", "-shm"):
+        try:
+            os.remove(path + suffix)
+        except FileNotFoundError:
+            pass
+
+
+def bind_orm(path: str):
+    """Переключает функции orm (писатель и пул читателей) на базу бенчмарка"""
+    orm.bind(f"sqlite+aiosqlite:///{path}")
+
+
+# --- ЗАМЕРЫ ---
+
+def percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def latency_row(users: int, op: str, timings: list[float], errors: int) -> dict:
+    return {
+        "users": users,
+        "op": op,
+        "mode": "latency",
+        "calls": len(timings),
+        "errors": errors,
+        "mean_ms": statistics.fmean(timings) * 1000,
+        "p50_ms": percentile(timings, 0.50) * 1000,
+        "p95_ms": percentile(timings, 0.95) * 1000,
+        "p99_ms": percentile(timings, 0.99) * 1000,
+    }
+
+
+async def measure_latency(users: int, op: str, call, ids: list[int], calls: int) -> dict:
+    timings, errors = [], 0
+    for _ in range(calls):
+        tg_id = random.choice(ids)
+        started = time.perf_counter()
+        try:
+            await call(tg_id)
+        except Exception:
+            errors += 1
+        timings.append(time.perf_counter() - started)
+    return latency_row(users, op, timings, errors)
+
+
+async def measure_throughput(users: int, op: str, call, ids: list[int], concurrency: int, calls: int) -> dict:
+    errors = 0
+
+    async def worker():
+        nonlocal errors
+        for _ in range(calls // concurrency):
+            try:
+                await call(random.choice(ids))
+            except Exception:
+                # Для SQLite это обычно "database is locked" при конкурентной записи
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    total = (calls // concurrency) * concurrency
+    return {
+        "users": users,
+        "op": op,
+        "mode": "throughput",
+        "concurrency": concurrency,
+        "calls": total,
+        "errors": errors,
+        "ops_per_sec": total / elapsed,
+    }
+
+
+async def measure_full_table(users: int, op: str, call, repeats: int) -> dict:
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        await call()
+        timings.append(time.perf_counter() - started)
+
+    # Память — отдельным прогоном: tracemalloc сильно замедляет аллокации и исказил бы время
+    tracemalloc.start()
+    await call()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    row = latency_row(users, op, timings, 0)
+    row["mode"] = "full_table"
+    row["peak_mem_kb"] = peak / 1024
+    return row
+
+
+async def capture_plans(path: str, ops: dict, sample_id: int) -> dict:
+    """Запускает каждую функцию один раз, перехватывает ее SQL и получает EXPLAIN QUERY PLAN"""
+    captured: list[tuple[str, tuple]] = []
+
+    def on_execute(conn, cursor, statement, parameters, context, executemany):
+        captured.append((statement, tuple(parameters) if parameters else ()))
+
+    engines = (orm.engine.sync_engine, orm.read_engine.sync_engine)
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", on_execute)
+    plans = {}
+    conn = sqlite3.connect(path)
+    try:
+        for op, call in ops.items():
+            captured.clear()
+            await call(sample_id) if op in POINT_OPS else await call()
+            plans[op] = []
+            for statement, parameters in captured:
+                if not statement.lstrip().upper().startswith(("SELECT", "UPDATE", "INSERT", "DELETE")):
+                    continue
+                rows = conn.execute(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()
+                plans[op].append({
+                    "sql": " ".join(statement.split()),
+                    "plan": [row[-1] for row in rows],
+                    "full_scan": any(row[-1].startswith("SCAN") for row in rows),
+                })
+    finally:
+        conn.close()
+        for engine in engines:
+            event.remove(engine, "before_cursor_execute", on_execute)
+    return plans
+
+
+async def bench_size(users: int, args) -> dict:
+    path = working_copy(database_for(users, args.seed, args.rebuild))
+    bind_orm(path)
+    random.seed(args.seed)
+    ids = [FIRST_TG_ID + i for i in random.sample(range(users), min(users, 10_000))]
+
+    rows = []
+    try:
+        # Кэш мог быть собран старой схемой: догоняем ее тем же init_db, что и бот при старте
+        # (новые таблицы и индексы), иначе замеры и планы были бы не про текущий прод
+        with contextlib.redirect_stdout(sys.stderr):
+            await orm.init_db()
+
+        for op, call in POINT_OPS.items():
+            rows.append(await measure_latency(users, op, call, ids, args.calls))
+            rows.append(await measure_throughput(users, op, call, ids, args.concurrency, args.calls))
+            print(f"  {op}: готово", file=sys.stderr)
+        for op, call in FULL_TABLE_OPS.items():
+            rows.append(await measure_full_table(users, op, call, args.repeats))
+            print(f"  {op}: готово", file=sys.stderr)
+
+        plans = await capture_plans(path, {**POINT_OPS, **FULL_TABLE_OPS}, ids[0])
+    finally:
+        await orm.dispose()
+        remove_database(path)
+
+    return {"users": users, "results": rows, "plans": plans}
+
+
+# --- ВЫВОД ---
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return None
+
+
+def print_table(report: dict):
+    for size in report["sizes"]:
+        print(f"\n=== {size['users']} пользователей ===")
+        for row in size["results"]:
+            if row["mode"] == "throughput":
+                print(f"{row['op']:<20} {row['mode']:<11} {row['ops_per_sec']:>10.0f} ops/s "
+                      f"(x{row['concurrency']}, ошибок {row['errors']})")
+            else:
+                extra = f", пик {row['peak_mem_kb']:.0f} КБ" if "peak_mem_kb" in row else ""
+                print(f"{row['op']:<20} {row['mode']:<11} p50 {row['p50_ms']:.2f} мс, "
+                      f"p95 {row['p95_ms']:.2f} мс, p99 {row['p99_ms']:.2f} мс{extra}")
+        for op, statements in size["plans"].items():
+            for statement in statements:
+                if statement["full_scan"]:
+                    print(f"⚠️  {op}: полный проход таблицы — {'; '.join(statement['plan'])}")
+
+
+def _row_key(row: dict) -> tuple:
+    return row["users"], row["op"], row["mode"]
+
+
+def print_comparison(report: dict, baseline_path: str):
+    """Сравнение с прошлым прогоном: >1.0 — стало медленнее (для ops/s — наоборот)"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    old = {_row_key(row): row for size in baseline["sizes"] for row in size["results"]}
+
+    print(f"\n=== Сравнение с {baseline_path} ({baseline['meta'].get('commit')}) ===")
+    for size in report["sizes"]:
+        for row in size["results"]:
+            before = old.get(_row_key(row))
+            if not before:
+                continue
+            if row["mode"] == "throughput":
+                ratio = before["ops_per_sec"] / row["ops_per_sec"]
+            else:
+                ratio = row["p50_ms"] / before["p50_ms"]
+            print(f"{row['users']:>9} {row['op']:<20} {row['mode']:<11} x{ratio:.2f}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--calls", type=int, default=500, help="вызовов точечной функции на замер")
+    parser.add_argument("--concurrency", type=int, default=20, help="параллельных корутин в замере throughput")
+    parser.add_argument("--repeats", type=int, default=5, help="повторов функций по всей таблице")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--rebuild", action="store_true", help="пересоздать кэшированные базы")
+    parser.add_argument("--out", help="куда записать JSON (по умолчанию только таблица)")
+    parser.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    args = parser.parse_args()
+
+    report = {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "args": vars(args),
+        },
+        "sizes": [],
+    }
+    for users in args.users:
+        print(f"▶ {users} пользователей", file=sys.stderr)
+        report["sizes"].append(await bench_size(users, args))
+
+    print_table(report)
+    if args.compare:
+        print_comparison(report, args.compare)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,6 +1,8 @@
 import asyncio
 import logging
+import multiprocessing
 import os
+import signal
 from aiohttp import web
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
@@ -9,7 +11,13 @@ from dotenv import load_dotenv
 
 # Импорты
 from app.database.orm import init_db
-from middlewares import LimitsMiddleware
+from app.services.outbound import send_scheduler
+from app.services.sharding import ShardRouter, poll_updates, consume_updates, use_router
+from app.services.premium import premium_reminders
+from app.config import BOT_WORKERS, TG_WEBHOOK_URL, TG_WEBHOOK_SECRET, WORKER_WATCHDOG_INTERVAL
+from middlewares import (
+    LimitsMiddleware, CommandDebounceMiddleware, DeadlineMiddleware, AdmissionMiddleware, ProfilerMiddleware
+)
 from app.handlers import user, payment, admin
 from app.handlers.webhook_handler import yookassa_webhook
 
@@ -20,11 +28,47 @@ WEB_SERVER_HOST = "0.0.0.0"
 WEB_SERVER_PORT = 8000
 # Путь, на который будет стучаться ЮKassa
 WEBHOOK_PATH = "/webhook/yookassa"
+# Путь для апдейтов Telegram (только при BOT_WORKERS > 1 и заданном TG_WEBHOOK_URL)
+TG_WEBHOOK_PATH = "/webhook/telegram"
+
+def create_bot(token: str) -> Bot:
+    bot = Bot(token=token, default=DefaultBotProperties(parse_mode=ParseMode.MARKDOWN))
+    # Все исходящие запросы идут через общий планировщик (лимиты Telegram, порядок, 429)
+    bot.session.middleware(send_scheduler)
+    return bot
+
+def setup_dispatcher() -> Dispatcher:
+    dp = Dispatcher()
+
+    # Подключаем Middleware и Роутеры
+    dp.update.outer_middleware(DeadlineMiddleware())
+    dp.message.outer_middleware(CommandDebounceMiddleware(user.text_debouncer))
+    # Замер хендлеров для профилировщика из админки (без сессии — просто пропускает)
+    dp.message.middleware(ProfilerMiddleware(admin.profiler))
+    dp.callback_query.middleware(ProfilerMiddleware(admin.profiler))
+    dp.include_router(admin.router)
+    dp.message.middleware(LimitsMiddleware())
+    dp.include_router(payment.router)
+    # Защита от перегрузки — после LimitsMiddleware, ей нужен is_premium
+    user.router.message.middleware(AdmissionMiddleware(user.admission))
+    dp.include_router(user.router)
+    return dp
 
 async def on_startup(app):
     """Эта функция запустится при старте сервера"""
     # 1. Инициализируем БД
     await init_db()
+
+    # Напоминания о подписке шлет один процесс — фронт (он же единственный при BOT_WORKERS=1)
+    premium_reminders.start(app["bot"])
+
+    if BOT_WORKERS > 1:
+        # Апдейты обрабатывают отдельные процессы, фронт только раздает их
+        await start_workers(app)
+        return
+
+    # Воркеры очереди картинок
+    user.image_queue.start()
     
     # 2. Запускаем бота (Polling) в фоновом режиме
     # Мы используем polling для бота, но сервер для платежей. Это удобно.
@@ -35,6 +79,93 @@ async def run_bot_polling(bot, dp):
     await bot.delete_webhook(drop_pending_updates=True)
     await dp.start_polling(bot)
 
+# --- НЕСКОЛЬКО ПРОЦЕССОВ ---
+
+def run_worker(index: int, queues):
+    """Процесс-обработчик: свой event loop, свой Dispatcher, апдейты только своих чатов"""
+    logging.basicConfig(level=logging.INFO, format=f"[worker {index}] %(levelname)s:%(name)s:%(message)s")
+    # Ctrl+C получает вся группа процессов — останавливаемся по сигналу от фронта, дочитав очередь
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(worker_main(index, queues))
+
+async def worker_main(index: int, queues):
+    # Очереди соседей нужны для служебных сообщений (сброс кэша подписки из админки)
+    use_router(ShardRouter(queues), index)
+    bot = create_bot(os.getenv("TG_TOKEN"))
+    dp = setup_dispatcher()
+    user.image_queue.start()
+    try:
+        await consume_updates(queues[index], dp, bot)
+    finally:
+        await bot.session.close()
+
+def spawn_worker(ctx, index: int, queues):
+    worker = ctx.Process(target=run_worker, args=(index, queues), name=f"bot-worker-{index}")
+    worker.start()
+    return worker
+
+async def watch_workers(app, ctx):
+    """Сторож: упавший воркер перезапускаем на той же очереди, иначе его чаты молча перестанут отвечать"""
+    workers = app["workers"]
+    queues = app["shard_router"].queues
+    while True:
+        await asyncio.sleep(WORKER_WATCHDOG_INTERVAL)
+        for index, worker in enumerate(workers):
+            if worker.is_alive():
+                continue
+            logging.error(f"Воркер {worker.name} упал (код {worker.exitcode}), перезапускаем")
+            workers[index] = spawn_worker(ctx, index, queues)
+
+async def start_workers(app):
+    # spawn, а не fork: у дочернего процесса не должно быть копии чужого event loop'а
+    ctx = multiprocessing.get_context("spawn")
+    queues = [ctx.Queue() for _ in range(BOT_WORKERS)]
+    workers = [spawn_worker(ctx, index, queues) for index in range(BOT_WORKERS)]
+
+    app["shard_router"] = ShardRouter(queues)
+    use_router(app["shard_router"])
+    app["workers"] = workers
+    app["watchdog"] = asyncio.create_task(watch_workers(app, ctx))
+    print(f"🧩 Запущено процессов-обработчиков: {BOT_WORKERS}")
+
+    bot = app["bot"]
+    allowed_updates = app["dp"].resolve_used_update_types()
+    if TG_WEBHOOK_URL:
+        await bot.set_webhook(
+            TG_WEBHOOK_URL.rstrip("/") + TG_WEBHOOK_PATH,
+            allowed_updates=allowed_updates,
+            secret_token=TG_WEBHOOK_SECRET or None,
+            drop_pending_updates=True
+        )
+    else:
+        app["poller"] = asyncio.create_task(poll_updates(bot, app["shard_router"], allowed_updates))
+
+async def telegram_webhook(request):
+    """Апдейт от Telegram: сразу отдаем нужному процессу, обработка — там"""
+    if TG_WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != TG_WEBHOOK_SECRET:
+        return web.Response(status=403)
+    request.app["shard_router"].route(await request.json())
+    return web.Response(status=200)
+
+async def on_cleanup(app):
+    # Сторожа останавливаем первым: воркеры, завершающиеся штатно, перезапускать не нужно
+    for name in ("watchdog", "poller"):
+        task = app.get(name)
+        if task:
+            task.cancel()
+
+    workers = app.get("workers", [])
+    if workers:
+        for queue in app["shard_router"].queues:
+            queue.put(None)
+    for worker in workers:
+        # Даем дообработать начатые апдейты, зависших добиваем
+        await asyncio.to_thread(worker.join, 30)
+        if worker.is_alive():
+            worker.terminate()
+
+    await app["bot"].session.close()
+
 def main():
     logging.basicConfig(level=logging.INFO)
 
@@ -43,15 +174,8 @@ def main():
         exit("Error: TG_TOKEN not found")
 
     # Инициализация бота
-    bot = Bot(token=TG_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.MARKDOWN))
-    dp = Dispatcher()
-
-    # Подключаем Middleware и Роутеры
-    dp.include_router(admin.router)
-    dp.message.middleware(LimitsMiddleware())
-    dp.include_router(payment.router)
-    dp.include_router(user.router)
-    
+    bot = create_bot(TG_TOKEN)
+    dp = setup_dispatcher()
 
     # --- НАСТРОЙКА ВЕБ-СЕРВЕРА ---
     app = web.Application()
@@ -62,9 +186,12 @@ def main():
 
     # Регистрируем адрес для ЮКассы
     app.router.add_post(WEBHOOK_PATH, yookassa_webhook)
+    if BOT_WORKERS > 1 and TG_WEBHOOK_URL:
+        app.router.add_post(TG_WEBHOOK_PATH, telegram_webhook)
     
     # Говорим серверу, что делать при старте
     app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
 
     # Запускаем сервер
     print(f"🚀 Сервер запущен на порту {WEB_SERVER_PORT}")
@@ -73,4 +200,4 @@ def main():
     web.run_app(app, host=WEB_SERVER_HOST, port=WEB_SERVER_PORT)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,7 +1,13 @@
+import time
 from aiogram import BaseMiddleware
 from aiogram.types import Message
 from app.database.orm import get_user
-from datetime import datetime
+from app.services.debounce import MessageDebouncer
+from app.services.deadline import deadline_scope
+from app.services.admission import AdmissionController, DEGRADE, REJECT
+from app.services.profiler import LoopProfiler
+from app.services.premium import premium_cache, premium_active
+from app.config import UPDATE_DEADLINE_SECONDS
 
 FREE_TEXT_LIMIT = 100
 FREE_IMAGE_LIMIT = 5
@@ -13,13 +19,21 @@ class LimitsMiddleware(BaseMiddleware):
             return await handler(event, data)
 
         user_id = event.from_user.id
+        profile = (event.from_user.username, event.from_user.full_name)
+        # Активному премиуму лимиты не нужны — обходимся без запроса в базу (пока профиль не менялся)
+        if premium_cache.is_premium(user_id, profile):
+            data["is_premium"] = True
+            return await handler(event, data)
+
         # Получаем пользователя (или создаем, если нет)
-        user = await get_user(user_id, event.from_user.username, event.from_user.full_name)
+        user = await get_user(user_id, *profile)
 
         # 1. Проверка на ПРЕМИУМ
-        is_premium = False
-        if user.premium_until and user.premium_until > datetime.utcnow():
-            is_premium = True
+        is_premium = premium_active(user)
+        premium_cache.remember(user)
+
+        # Тариф нужен хендлерам (бюджеты токенов), прокидываем его дальше
+        data["is_premium"] = is_premium
 
         if is_premium:
             return await handler(event, data)
@@ -49,4 +63,66 @@ class LimitsMiddleware(BaseMiddleware):
                 await event.answer("⛔️ Лимит запросов исчерпан!\nКупите подписку: /buy")
                 return
 
-        return await handler(event, data)
\ No newline at end of file
+        return await handler(event, data)
+
+class CommandDebounceMiddleware(BaseMiddleware):
+    """
+    Команда закрывает склейку: накопленный текст сразу уходит в нейросеть, до команды,
+    а не после нее — и не пропадает молча
+    """
+    def __init__(self, debouncer: MessageDebouncer):
+        self.debouncer = debouncer
+
+    async def __call__(self, handler, event, data):
+        if isinstance(event, Message) and event.text and event.text.startswith('/'):
+            self.debouncer.flush(event)
+        return await handler(event, data)
+
+class DeadlineMiddleware(BaseMiddleware):
+    """Открывает общий бюджет времени на апдейт: все внешние вызовы внутри укладываются в него"""
+    async def __call__(self, handler, event, data):
+        with deadline_scope(UPDATE_DEADLINE_SECONDS):
+            return await handler(event, data)
+
+class AdmissionMiddleware(BaseMiddleware):
+    """
+    Сброс нагрузки перед запросами к нейросети. Премиум пропускается всегда,
+    free при перегрузке сначала деградирует (ждет дольше, дешевая модель), затем получает отказ.
+    """
+    def __init__(self, controller: AdmissionController):
+        self.controller = controller
+
+    async def __call__(self, handler, event, data):
+        if not isinstance(event, Message):
+            return await handler(event, data)
+
+        # Считаем только запросы к нейросети: фото (Vision) и текст без команды
+        is_llm_request = bool(event.photo) or bool(event.text and not event.text.startswith('/'))
+        if not is_llm_request or data.get("is_premium"):
+            return await handler(event, data)
+
+        stage = self.controller.stage()
+        if stage == REJECT:
+            await event.answer("🔥 Бот сейчас перегружен. Попробуйте через пару минут.\nПремиум обслуживается без очереди: /buy")
+            return
+        if stage == DEGRADE:
+            data["degraded"] = True
+            await event.answer("⏳ Сейчас много запросов, ответ может задержаться.")
+
+        return await handler(event, data)
+
+class ProfilerMiddleware(BaseMiddleware):
+    """Замеряет время хендлеров, только пока в админке запущено профилирование"""
+    def __init__(self, profiler: LoopProfiler):
+        self.profiler = profiler
+
+    async def __call__(self, handler, event, data):
+        if not self.profiler.running:
+            return await handler(event, data)
+
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            name = data["handler"].callback.__qualname__
+            self.profiler.record_handler(name, time.perf_counter() - started)
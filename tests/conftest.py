@@ -0,0 +1,31 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+# Настройки, без которых модули бота не импортируются (.env в тестах не нужен)
+os.environ.setdefault("TG_TOKEN", "1:test")
+os.environ.setdefault("OPENROUTER_API_KEY", "test")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.database import orm  # noqa: E402 — после настроек окружения
+
+
+@pytest.fixture
+def run_db(tmp_path):
+    """Запускает корутину-сценарий на чистой временной базе (init_db до, dispose после)"""
+    orm.bind(f"sqlite+aiosqlite:///{tmp_path / 'bot.db'}")
+
+    def run(scenario):
+        async def wrapped():
+            await orm.init_db()
+            try:
+                return await scenario()
+            finally:
+                await orm.dispose()
+        return asyncio.run(wrapped())
+
+    yield run
+    orm.bind(orm.DATABASE_URL)
@@ -0,0 +1,55 @@
+import asyncio
+from datetime import datetime
+
+from aiogram.types import Chat, Message, User
+
+from app.services.debounce import MessageDebouncer
+from middlewares import CommandDebounceMiddleware
+
+
+def make_message(message_id: int, text: str, user_id: int = 2) -> Message:
+    return Message(
+        message_id=message_id, date=datetime.now(), text=text,
+        chat=Chat(id=1, type="group"), from_user=User(id=user_id, is_bot=False, first_name="Тест")
+    )
+
+
+def test_command_flushes_pending_text_before_running():
+    flushed = []
+    seen_by_command = []
+
+    async def on_flush(messages, **context):
+        flushed.append(([m.text for m in messages], context))
+
+    async def scenario():
+        # Окно длинное: без команды пачка ушла бы только через минуту
+        debouncer = MessageDebouncer(60, on_flush)
+        debouncer.push(make_message(1, "первая часть"), is_premium=True)
+        debouncer.push(make_message(2, "вторая часть"), is_premium=True)
+        # Чужая пачка в том же чате команда не трогает
+        debouncer.push(make_message(3, "другой автор", user_id=3))
+
+        async def command_handler(event, data):
+            seen_by_command.append(dict(debouncer._pending))
+
+        middleware = CommandDebounceMiddleware(debouncer)
+        await middleware(command_handler, make_message(4, "/start"), {})
+        await asyncio.sleep(0)
+        return debouncer
+
+    debouncer = asyncio.run(scenario())
+
+    assert flushed == [(["первая часть", "вторая часть"], {"is_premium": True})]
+    assert list(seen_by_command[0]) == [(1, 3)]
+    assert (1, 2) not in debouncer._timers
+
+
+def test_command_without_pending_text_flushes_nothing():
+    async def on_flush(messages, **context):
+        raise AssertionError("нечего отправлять")
+
+    async def scenario():
+        debouncer = MessageDebouncer(60, on_flush)
+        return debouncer.flush(make_message(1, "/help"))
+
+    assert asyncio.run(scenario()) is False
@@ -0,0 +1,108 @@
+import asyncio
+
+from app.services.image_queue import ImageQueue, ImageJob, RenderSpec
+
+
+class FakeMessage:
+    """Сообщение Telegram: запоминает, каким его в итоге увидел пользователь"""
+
+    def __init__(self):
+        self.text = None
+        self.caption = None
+
+    async def edit_text(self, text, **kwargs):
+        self.text = text
+
+    async def edit_caption(self, caption, **kwargs):
+        self.caption = caption
+
+
+def make_queue(render, deliver, show_preview=None, charges=None, max_attempts=2):
+    async def no_preview(job, data):
+        raise AssertionError("превью не ожидалось")
+
+    async def charge(job):
+        if charges is not None:
+            charges.append(job.user_id)
+
+    return ImageQueue(
+        render=render, deliver=deliver, show_preview=show_preview or no_preview, charge=charge,
+        workers=1, max_size=10, max_attempts=max_attempts, retry_delay=0, deadline=5
+    )
+
+
+def make_job(preview: RenderSpec = None) -> ImageJob:
+    return ImageJob(
+        message=FakeMessage(), status=FakeMessage(), prompt="кот", user_id=1,
+        final=RenderSpec(1024, "flux"), preview=preview
+    )
+
+
+def test_delivery_error_is_reported_to_user_without_rerendering():
+    renders = []
+
+    async def render(prompt, spec, seed):
+        renders.append(spec)
+        return b"image"
+
+    async def deliver(job, data):
+        raise RuntimeError("Telegram: Bad Request")
+
+    charges = []
+
+    async def scenario():
+        queue = make_queue(render, deliver, charges=charges)
+        job = make_job()
+        await queue._process(job)
+        return job
+
+    job = asyncio.run(scenario())
+
+    assert job.status.text == "Ошибка генерации или сервис недоступен."
+    assert len(renders) == 1
+    assert charges == []
+
+
+def test_kept_preview_is_charged_and_marked_when_final_render_fails():
+    preview_spec = RenderSpec(256, "flux")
+
+    async def render(prompt, spec, seed):
+        if spec == preview_spec:
+            return b"preview"
+        await asyncio.sleep(0.05)
+        return None
+
+    async def show_preview(job, data):
+        job.preview_message = FakeMessage()
+
+    async def deliver(job, data):
+        raise AssertionError("полная картинка не рисовалась")
+
+    charges = []
+
+    async def scenario():
+        queue = make_queue(render, deliver, show_preview=show_preview, charges=charges)
+        job = make_job(preview=preview_spec)
+        await queue._process(job)
+        return job
+
+    job = asyncio.run(scenario())
+
+    assert job.preview_message.caption == "⚠️ Полную версию нарисовать не удалось, осталось только превью."
+    assert charges == [1]
+
+
+def test_delivered_image_is_charged_once():
+    async def render(prompt, spec, seed):
+        return b"image"
+
+    delivered = []
+
+    async def deliver(job, data):
+        delivered.append(data)
+
+    charges = []
+    asyncio.run(make_queue(render, deliver, charges=charges)._process(make_job()))
+
+    assert delivered == [b"image"]
+    assert charges == [1]
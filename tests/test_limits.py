@@ -0,0 +1,57 @@
+from datetime import datetime, timedelta
+
+from aiogram.types import Chat, Message, User
+from sqlalchemy import select, update
+
+import middlewares
+from app.database import orm
+from app.services.premium import premium_cache
+from middlewares import LimitsMiddleware
+
+
+def make_message(username: str) -> Message:
+    return Message(
+        message_id=1, date=datetime.now(), text="привет", chat=Chat(id=11, type="private"),
+        from_user=User(id=11, is_bot=False, first_name="Анна", username=username)
+    )
+
+
+def test_premium_fast_path_refreshes_changed_profile(run_db, monkeypatch):
+    lookups = []
+    real_get_user = orm.get_user
+
+    async def counting_get_user(*args):
+        lookups.append(args)
+        return await real_get_user(*args)
+
+    monkeypatch.setattr(middlewares, "get_user", counting_get_user)
+
+    async def scenario():
+        await orm.get_user(11, "old_name", "Анна")
+        await orm.writer.submit(lambda session: session.execute(
+            update(orm.User).where(orm.User.telegram_id == 11)
+            .values(premium_until=datetime.utcnow() + timedelta(days=5))
+        ))
+
+        seen = []
+
+        async def handler(event, data):
+            seen.append(data["is_premium"])
+
+        limits = LimitsMiddleware()
+        await limits(handler, make_message("old_name"), {})  # заполняет кэш
+        await limits(handler, make_message("old_name"), {})  # из кэша, без базы
+        await limits(handler, make_message("new_name"), {})  # профиль сменился — через базу
+
+        async with orm.read_session() as session:
+            username = await session.scalar(select(orm.User.username).where(orm.User.telegram_id == 11))
+        return seen, username
+
+    try:
+        seen, username = run_db(scenario)
+    finally:
+        premium_cache.invalidate(11)
+
+    assert seen == [True, True, True]
+    assert username == "new_name"
+    assert len(lookups) == 2
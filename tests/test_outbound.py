@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from app.services.outbound import OutboundScheduler, bulk_sends
+
+
+def make_scheduler(max_retries: int = 2) -> OutboundScheduler:
+    # Лимиты заведомо выше нагрузки теста: проверяем 429 и порядок, а не темп
+    return OutboundScheduler(global_rate=1000, chat_rate=1000, chat_burst=100, group_rate=1000,
+                             max_retries=max_retries)
+
+
+class FakeTelegram:
+    """make_request: первые ответы на указанные тексты — 429, дальше успех"""
+
+    def __init__(self, throttled: dict[str, int], retry_after: int = 0):
+        self.throttled = dict(throttled)
+        self.retry_after = retry_after
+        self.attempts = []
+        self.delivered = []
+
+    async def __call__(self, bot, method):
+        self.attempts.append(method.text)
+        if self.throttled.get(method.text, 0) > 0:
+            self.throttled[method.text] -= 1
+            raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=self.retry_after)
+        self.delivered.append(method.text)
+        return method.text
+
+
+def test_retry_after_is_waited_out_and_retried():
+    scheduler = make_scheduler()
+    telegram = FakeTelegram({"привет": 2})
+
+    result = asyncio.run(scheduler(telegram, None, SendMessage(chat_id=5, text="привет")))
+
+    assert result == "привет"
+    assert telegram.attempts == ["привет"] * 3
+    assert scheduler.stats()["retry_after"] == 2
+    assert scheduler.stats()["sent"] == 1
+
+
+def test_retry_after_beyond_max_retries_is_raised():
+    scheduler = make_scheduler(max_retries=1)
+    telegram = FakeTelegram({"привет": 5})
+
+    with pytest.raises(TelegramRetryAfter):
+        asyncio.run(scheduler(telegram, None, SendMessage(chat_id=5, text="привет")))
+    assert len(telegram.attempts) == 2
+
+
+def test_next_message_in_chat_waits_for_throttled_one():
+    scheduler = make_scheduler()
+    telegram = FakeTelegram({"первое": 1}, retry_after=1)
+
+    async def scenario():
+        first = asyncio.create_task(scheduler(telegram, None, SendMessage(chat_id=5, text="первое")))
+        await asyncio.sleep(0.05)
+        # Пока первое ждет RetryAfter, второе в тот же чат не обгоняет его, а в другой чат — уходит
+        second = asyncio.create_task(scheduler(telegram, None, SendMessage(chat_id=5, text="второе")))
+        other = asyncio.create_task(scheduler(telegram, None, SendMessage(chat_id=6, text="другой чат")))
+        await asyncio.gather(first, second, other)
+
+    asyncio.run(scenario())
+
+    assert telegram.delivered == ["другой чат", "первое", "второе"]
+
+
+def test_interactive_sends_go_ahead_of_bulk():
+    scheduler = OutboundScheduler(global_rate=20, chat_rate=1000, chat_burst=100, group_rate=1000, max_retries=0)
+    # Общий лимит уже выбран: все три отправки встают в очередь к следующему токену
+    scheduler._global.bucket.tokens = 0
+    telegram = FakeTelegram({})
+
+    async def scenario():
+        async def broadcast():
+            with bulk_sends():
+                await asyncio.gather(*(
+                    scheduler(telegram, None, SendMessage(chat_id=100 + i, text=f"рассылка {i}")) for i in range(2)
+                ))
+
+        bulk = asyncio.create_task(broadcast())
+        await asyncio.sleep(0.01)
+        reply = asyncio.create_task(scheduler(telegram, None, SendMessage(chat_id=5, text="ответ")))
+        await asyncio.gather(bulk, reply)
+
+    asyncio.run(scenario())
+
+    # Ответ пришел позже рассылки, но уходит первым
+    assert telegram.delivered == ["ответ", "рассылка 0", "рассылка 1"]
@@ -0,0 +1,83 @@
+from datetime import datetime, timedelta
+
+from aiogram.exceptions import TelegramForbiddenError
+from aiogram.methods import SendMessage
+from sqlalchemy import update
+
+from app.database import orm
+from app.services.premium import PremiumReminderScheduler, EXPIRED
+
+
+class FakeBot:
+    def __init__(self, errors: dict = None):
+        self.sent = []
+        self.errors = errors or {}
+
+    async def send_message(self, chat_id, text, **kwargs):
+        error = self.errors.get(chat_id)
+        if error is not None:
+            raise error
+        self.sent.append(chat_id)
+
+
+def make_scheduler() -> PremiumReminderScheduler:
+    return PremiumReminderScheduler(
+        remind_before=timedelta(days=3), expired_window=timedelta(hours=12), interval=600, batch_size=100
+    )
+
+
+async def set_premium_until(tg_id: int, until: datetime):
+    await orm.get_user(tg_id)
+    await orm.writer.submit(lambda session: session.execute(
+        update(orm.User).where(orm.User.telegram_id == tg_id).values(premium_until=until)
+    ))
+
+
+def test_expired_notices_survive_downtime_longer_than_window(run_db):
+    now = datetime.utcnow()
+
+    async def scenario():
+        # Последнее уведомление ушло 3 дня назад, потом бот лежал
+        await set_premium_until(1, now - timedelta(days=3))
+        await orm.claim_premium_reminder(1, EXPIRED, now - timedelta(days=3))
+        # Истекла за время простоя — дольше окна в 12 часов
+        await set_premium_until(2, now - timedelta(days=2))
+        # Давно истекшая, до последнего уведомления — ее уже не трогаем
+        await set_premium_until(3, now - timedelta(days=30))
+
+        bot = FakeBot()
+        await make_scheduler().run_once(bot)
+        await make_scheduler().run_once(bot)
+        return bot.sent
+
+    assert run_db(scenario) == [2]
+
+
+def test_first_run_notifies_only_within_window(run_db):
+    now = datetime.utcnow()
+
+    async def scenario():
+        await set_premium_until(1, now - timedelta(hours=1))
+        await set_premium_until(2, now - timedelta(days=30))
+        bot = FakeBot()
+        await make_scheduler().run_once(bot)
+        return bot.sent
+
+    assert run_db(scenario) == [1]
+
+
+def test_transient_send_error_releases_claim(run_db):
+    now = datetime.utcnow()
+    forbidden = TelegramForbiddenError(method=SendMessage(chat_id=2, text="x"), message="bot was blocked")
+
+    async def scenario():
+        await set_premium_until(1, now - timedelta(hours=1))
+        await set_premium_until(2, now - timedelta(hours=1))
+
+        await make_scheduler().run_once(FakeBot(errors={1: RuntimeError("network"), 2: forbidden}))
+        # Сеть восстановилась: временный сбой повторяется, заблокировавшему бот больше не пишем
+        retry = FakeBot()
+        await make_scheduler().run_once(retry)
+        return retry.sent
+
+    assert run_db(scenario) == [1]
@@ -0,0 +1,48 @@
+import asyncio
+import importlib.util
+import time
+
+from app.services.profiler import LoopProfiler
+
+# Сторонний код: файл вне проекта, как библиотека из site-packages
+LIBRARY_CODE = """
+import time
+
+def crunch(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+"""
+
+
+def load_library(tmp_path):
+    path = tmp_path / "thirdparty_lib.py"
+    path.write_text(LIBRARY_CODE)
+    spec = importlib.util.spec_from_file_location("thirdparty_lib", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_library_time_is_credited_to_calling_handler(tmp_path):
+    library = load_library(tmp_path)
+
+    async def handle_update():
+        await asyncio.sleep(0.05)
+        library.crunch(0.4)
+
+    async def scenario():
+        profiler = LoopProfiler(sample_interval=0.005, slow_callback=0.1)
+        task = asyncio.create_task(handle_update())
+        report = await profiler.run(0.6)
+        await task
+        return report
+
+    report = asyncio.run(scenario())
+
+    hot, _ = report.hot_functions.most_common(1)[0]
+    assert hot.startswith("handle_update (tests/test_profiler.py)")
+    assert not any("app/services/profiler.py" in name for name in report.hot_functions)
+    assert all("app/services/profiler.py" not in stack for stack in report.stacks)
+    assert any(stack.endswith("crunch (thirdparty_lib.py)") for stack in report.stacks)
+    assert report.slow_callbacks and report.slow_callbacks[0][0].endswith("handle_update")
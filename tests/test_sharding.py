@@ -0,0 +1,57 @@
+import asyncio
+import queue
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from app.services import sharding
+from app.services.premium import premium_cache, invalidate_premium
+from app.services.sharding import ShardRouter, consume_updates, use_router
+
+
+class RecordingDispatcher:
+    def __init__(self):
+        self.updates = []
+
+    async def feed_raw_update(self, bot, update):
+        self.updates.append(update)
+
+
+def premium_user(tg_id: int):
+    return SimpleNamespace(
+        telegram_id=tg_id, username=None, full_name="Тест", premium_until=datetime.utcnow() + timedelta(days=1)
+    )
+
+
+def test_premium_invalidation_reaches_every_worker():
+    queues = [queue.Queue(), queue.Queue()]
+    use_router(ShardRouter(queues), index=0)
+    try:
+        premium_cache.remember(premium_user(42))
+        invalidate_premium(42)
+    finally:
+        use_router(None)
+
+    # Свой кэш сброшен сразу, остальные воркеры получают сообщение в своей очереди
+    assert not premium_cache.is_premium(42)
+    for worker_queue in queues:
+        assert worker_queue.get_nowait() == {sharding.CONTROL_KEY: "premium_invalidate", "tg_id": 42}
+
+
+def test_worker_applies_control_message_instead_of_dispatching_it():
+    premium_cache.remember(premium_user(7))
+    worker_queue = queue.Queue()
+    update = {"update_id": 1, "message": {"chat": {"id": 7}}}
+    for item in ({sharding.CONTROL_KEY: "premium_invalidate", "tg_id": 7}, update, None):
+        worker_queue.put(item)
+
+    dp = RecordingDispatcher()
+    asyncio.run(consume_updates(worker_queue, dp, bot=None))
+
+    assert not premium_cache.is_premium(7)
+    assert dp.updates == [update]
+
+
+def test_single_process_does_not_broadcast():
+    premium_cache.remember(premium_user(9))
+    invalidate_premium(9)
+    assert not premium_cache.is_premium(9)
@@ -0,0 +1,39 @@
+import sqlite3
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+from app.database import orm
+
+
+def test_stats_come_from_one_snapshot(run_db, tmp_path):
+    writes = []
+
+    def write_between_queries(conn, cursor, statement, parameters, context, executemany):
+        # Параллельный коммит другого процесса сразу после первого запроса статистики
+        if writes or "sum(users.text_usage)" not in statement:
+            return
+        writes.append(statement)
+        now = datetime.utcnow()
+        until = now + timedelta(days=30)
+        other = sqlite3.connect(tmp_path / "bot.db")
+        with other:
+            other.execute(
+                "INSERT INTO users (telegram_id, text_usage, image_usage, premium_until, joined_at) VALUES (2, 0, 0, ?, ?)",
+                (until.isoformat(" "), now.isoformat(" "))
+            )
+        other.close()
+
+    async def scenario():
+        await orm.get_user(1)
+        event.listen(orm.read_engine.sync_engine, "after_cursor_execute", write_between_queries)
+        during = await orm.get_stats()
+        event.remove(orm.read_engine.sync_engine, "after_cursor_execute", write_between_queries)
+        after = await orm.get_stats()
+        return during, after
+
+    during, after = run_db(scenario)
+
+    # Пользователь появился после первого запроса — его не видит ни один запрос этого снимка
+    assert (during["total_users"], during["active_premium"]) == (1, 0)
+    assert (after["total_users"], after["active_premium"]) == (2, 1)
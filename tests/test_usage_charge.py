@@ -0,0 +1,62 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.handlers import user
+from app.services.deadline import ExternalCallError, RateLimited, UpstreamTimeout
+
+
+class FakeBot:
+    async def send_chat_action(self, chat_id, action):
+        pass
+
+
+class FakeMessage:
+    def __init__(self, text: str):
+        self.text = text
+        self.from_user = SimpleNamespace(id=5)
+        self.chat = SimpleNamespace(id=5)
+        self.bot = FakeBot()
+        self.answers = []
+
+    async def answer(self, text, **kwargs):
+        self.answers.append(text)
+
+
+@pytest.fixture
+def charges(monkeypatch):
+    charged = []
+
+    async def increment_usage(tg_id, kind):
+        charged.append((tg_id, kind))
+
+    monkeypatch.setattr(user, "increment_usage", increment_usage)
+    return charged
+
+
+@pytest.mark.parametrize("error", [UpstreamTimeout("timeout"), RateLimited("429"), ExternalCallError("400")])
+def test_failed_text_request_is_not_charged(monkeypatch, charges, error):
+    async def generate_text(*args, **kwargs):
+        raise error
+
+    monkeypatch.setattr(user, "generate_text", generate_text)
+    message = FakeMessage("привет")
+
+    asyncio.run(user.answer_text([message]))
+
+    assert charges == []
+    assert message.answers == [error.user_text or "Произошла ошибка при генерации текста. Попробуйте позже."]
+
+
+def test_answered_text_request_is_charged_once(monkeypatch, charges):
+    async def generate_text(*args, **kwargs):
+        return "ответ"
+
+    monkeypatch.setattr(user, "generate_text", generate_text)
+    messages = [FakeMessage("привет"), FakeMessage("как дела")]
+
+    asyncio.run(user.answer_text(messages))
+
+    assert charges == [(5, "text")]
+    assert messages[-1].answers == ["ответ"]
@@ -0,0 +1,89 @@
+import asyncio
+
+from sqlalchemy import select
+
+from app.database import orm
+
+
+async def text_usage(tg_id: int) -> int:
+    async with orm.read_session() as session:
+        return await session.scalar(select(orm.User.text_usage).where(orm.User.telegram_id == tg_id))
+
+
+async def user_exists(tg_id: int) -> bool:
+    async with orm.read_session() as session:
+        return await session.scalar(select(orm.User.id).where(orm.User.telegram_id == tg_id)) is not None
+
+
+def add_user(tg_id: int):
+    async def op(session):
+        session.add(orm.User(telegram_id=tg_id))
+        await session.flush()
+        return tg_id
+    return op
+
+
+def test_concurrent_writes_share_one_commit(run_db):
+    async def scenario():
+        await orm.get_user(1)
+        commits, writes = orm.writer.commits, orm.writer.writes
+        await asyncio.gather(*(orm.increment_usage(1, "text") for _ in range(5)))
+        return orm.writer.commits - commits, orm.writer.writes - writes, await text_usage(1)
+
+    assert run_db(scenario) == (1, 5, 5)
+
+
+def test_failing_op_does_not_affect_its_batch(run_db):
+    class Boom(Exception):
+        pass
+
+    def add_user_then_fail(tg_id: int):
+        async def op(session):
+            # Частичная запись упавшей операции тоже должна откатиться
+            await add_user(tg_id)(session)
+            raise Boom("op failed")
+        return op
+
+    async def scenario():
+        await orm.get_user(1)
+        results = await asyncio.gather(
+            orm.writer.submit(add_user(100)),
+            orm.writer.submit(add_user_then_fail(101)),
+            orm.increment_usage(1, "text"),
+            return_exceptions=True
+        )
+        return results, await user_exists(100), await user_exists(101), await text_usage(1)
+
+    results, has_100, has_101, usage = run_db(scenario)
+
+    assert results[0] == 100
+    assert isinstance(results[1], Boom)
+    assert results[2] is None
+    assert (has_100, has_101) == (True, False)
+    # Пачку провели заново по SAVEPOINT'ам — успешные операции применились ровно один раз
+    assert usage == 1
+
+
+def test_failing_op_error_reaches_only_its_caller(run_db):
+    async def scenario():
+        # Конфликт уникального telegram_id: вторая вставка падает уже в базе
+        return await asyncio.gather(
+            orm.writer.submit(add_user(7)),
+            orm.writer.submit(add_user(7)),
+            return_exceptions=True
+        )
+
+    first, second = run_db(scenario)
+    assert first == 7
+    assert isinstance(second, Exception)
+
+
+def test_concurrent_increments_are_not_lost(run_db):
+    calls = 300
+
+    async def scenario():
+        await orm.get_user(1)
+        await asyncio.gather(*(orm.increment_usage(1, "text") for _ in range(calls)))
+        return await text_usage(1)
+
+    assert run_db(scenario) == calls